@@ -25,18 +25,13 @@ from abc import abstractmethod
 import numpy
 
 from dr14meter.audio_track import AudioTrack, StructDuration
-from dr14meter.compressor import DynCompressor
 from dr14meter.read_metadata import RetrieveMetadata
 
-from dr14meter.plot.dr_histogram import compute_hist
-from dr14meter.plot.lev_histogram import compute_lev_hist
-from dr14meter.plot.spectrogram import spectrogram
-from dr14meter.plot.dynamic_vivacity import dynamic_vivacity
-from dr14meter.plot.plot_track import plot_track
-from dr14meter.plot.plot_track_classic import plot_track_classic
-
 from dr14meter.out_messages import print_msg
 
+# the plot modules import matplotlib and the compressor scipy: they are imported by
+# the analysis that uses them
+
 
 class AudioAnalysis:
 
@@ -82,6 +77,7 @@ class AudioAnalysis:
 class AudioDynVivacity(AudioAnalysis):
 
     def virt_compute(self):
+        from dr14meter.plot.dynamic_vivacity import dynamic_vivacity
         super().virt_compute()
         at = self.getAudioTrack()
         dynamic_vivacity(at.Y, at.Fs)
@@ -90,6 +86,7 @@ class AudioDynVivacity(AudioAnalysis):
 class AudioDrHistogram(AudioAnalysis):
 
     def virt_compute(self):
+        from dr14meter.plot.dr_histogram import compute_hist
         title = super().virt_compute()
         at = self.getAudioTrack()
         compute_hist(at.Y, at.Fs, self.getDuration(), title=title)
@@ -98,6 +95,7 @@ class AudioDrHistogram(AudioAnalysis):
 class AudioLevelHistogram(AudioAnalysis):
 
     def virt_compute(self):
+        from dr14meter.plot.lev_histogram import compute_lev_hist
         title = super().virt_compute()
         at = self.getAudioTrack()
         compute_lev_hist(at.Y, at.Fs, self.getDuration(), title=title)
@@ -106,6 +104,7 @@ class AudioLevelHistogram(AudioAnalysis):
 class AudioSpectrogram(AudioAnalysis):
 
     def virt_compute(self):
+        from dr14meter.plot.spectrogram import spectrogram
         super().virt_compute()
         at = self.getAudioTrack()
         spectrogram(at.Y, at.Fs)
@@ -114,6 +113,7 @@ class AudioSpectrogram(AudioAnalysis):
 class AudioPlotTrack(AudioAnalysis):
 
     def virt_compute(self):
+        from dr14meter.plot.plot_track_classic import plot_track_classic
         super().virt_compute()
         at = self.getAudioTrack()
         plot_str = plot_track_classic(at.Y, at.Fs)
@@ -123,6 +123,7 @@ class AudioPlotTrack(AudioAnalysis):
 class AudioPlotTrackDistribution(AudioAnalysis):
 
     def virt_compute(self):
+        from dr14meter.plot.plot_track import plot_track
         super().virt_compute()
         at = self.getAudioTrack()
         plot_track(at.Y, at.Fs)
@@ -134,6 +135,7 @@ class AudioCompressor(AudioAnalysis):
         self.compression_modality = compression_modality
 
     def virt_compute(self):
+        from dr14meter.compressor import DynCompressor
 
         comp = DynCompressor()
         comp.set_compression_modality(self.compression_modality)
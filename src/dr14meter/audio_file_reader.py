@@ -22,13 +22,14 @@ import time
 import sys
 import tempfile
 import subprocess
-import wave
 import numpy
 import shutil
+import struct
 
 
 from dr14meter.out_messages import print_msg, dr14_log_info
 from dr14meter.dr14_global import get_ffmpeg_cmd
+from dr14meter.wav_file import WavFile, parse_fmt_chunk
 
 #from _ftdi1 import NONE
 
@@ -42,8 +43,22 @@ from dr14meter.dr14_global import get_ffmpeg_cmd
 #         return False
 
 
+# initial size of the decoding buffer, 5 minutes at 44.1 kHz
+PIPE_BUFFER_FRAMES = 44100 * 300
+
+# frames per chunk when the track is read as a stream, about 6 seconds at 44.1 kHz
+STREAM_CHUNK_FRAMES = 1 << 18
+
+
 class AudioFileReader:
 
+    # decode through the ffmpeg stdout instead of a temporary wav file
+    use_pipe = True
+
+    @classmethod
+    def available(cls):
+        return True
+
     def __init__(self):
         self.__ffmpeg_cmd = get_ffmpeg_cmd()
 
@@ -69,7 +84,55 @@ class AudioFileReader:
             '-loglevel', 'quiet',
         ]
 
+    def get_pipe_cmd_options(self, file_name):
+        return [
+            '-i',
+            file_name,
+            *'-vn -map_metadata -1 -fflags +bitexact'.split(),
+            *'-acodec pcm_s16le -ar 44100 -f wav'.split(),
+            'pipe:1',
+            '-loglevel', 'quiet',
+        ]
+
     def read_audio_file_new(self, file_name, target):
+        if self.use_pipe:
+            return self.read_audio_pipe(file_name, target)
+        return self.read_audio_file_tmp(file_name, target)
+
+    def open_audio_stream(self, file_name):
+        """Start decoding the file, return a PcmStream or None on error."""
+        file_name = pathlib.Path(file_name)
+
+        if not self.use_pipe:
+            return self.open_audio_stream_tmp(file_name)
+
+        full_command = [self.__cmd] + self.get_pipe_cmd_options(file_name)
+
+        try:
+            proc = subprocess.Popen(full_command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+            return FfmpegPcmStream(proc)
+        except:
+            print_msg(f"Unexpected error: {sys.exc_info()}")
+            print_msg("\n - ERROR ! ")
+            return None
+
+    def open_audio_stream_tmp(self, file_name):
+        time_a = time.time_ns()
+
+        tmp_file = pathlib.Path(tempfile.gettempdir(), file_name.name + f"-{time_a}.wav")
+        full_command = [self.__cmd] + self.get_cmd_options(file_name, tmp_file)
+
+        try:
+            subprocess.check_call(full_command, shell=False)
+            return WavPcmStream(tmp_file, remove=True)
+        except:
+            tmp_file.unlink(missing_ok=True)
+            print_msg(f"Unexpected error: {sys.exc_info()}")
+            print_msg("\n - ERROR ! ")
+            return None
+
+    def read_audio_file_tmp(self, file_name, target):
         file_name = pathlib.Path(file_name)
 
         time_a = time.time_ns()
@@ -85,38 +148,54 @@ class AudioFileReader:
         tmp_file.unlink(missing_ok=True)
 
         time_a = time.time_ns() - time_a
-        dr14_log_info(f"AudioFileReader.read_audio_file_new: Clock: {time_a / 1000_000_000:2.8f}")
+        dr14_log_info(f"AudioFileReader.read_audio_file_tmp: Clock: {time_a / 1000_000_000:2.8f}")
 
         return ret_f
 
-    def read_wav(self, file_name, target):
+    def read_audio_pipe(self, file_name, target):
+        """Decode the file with ffmpeg and read the PCM stream from its stdout, no temporary file is written."""
         file_name = pathlib.Path(file_name)
 
         time_a = time.time_ns()
 
+        full_command = [self.__cmd] + self.get_pipe_cmd_options(file_name)
+
         try:
-            with wave.open(str(file_name), 'rb') as wave_read:
+            with subprocess.Popen(full_command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL) as proc:
+                channels, Fs, sample_width = read_wav_header(proc.stdout)
+                X = read_pcm_stream(proc.stdout, channels, sample_width)
+                if proc.wait() != 0:
+                    raise RuntimeError(f"{self.__cmd} exited with code {proc.returncode}")
+
+            target.channels = channels
+            target.Fs = Fs
+            target.sample_width = sample_width
+            target.Y = pcm_to_float(X, sample_width)
+        except:
+            print_msg(f"Unexpected error: {sys.exc_info()}")
+            print_msg("\n - ERROR ! ")
+            return False
 
-                target.channels = wave_read.getnchannels()
-                target.Fs = wave_read.getframerate()
-                target.sample_width = wave_read.getsampwidth()
+        time_a = time.time_ns() - time_a
+        dr14_log_info(f"AudioFileReader.read_audio_pipe: Clock: {time_a / 1000_000_000:2.8f}")
 
-                nframes = wave_read.getnframes()
-                #print_msg( file_name + "!!!!!!!!!!!!: " + str(target.channels) + " " + str(target.sample_width ) + " " + str( target.Fs ) + " " + str( nframes ) )
+        return True
 
-                X = wave_read.readframes(wave_read.getnframes())
-                sample_type = f"int{target.sample_width * 8}"
-                target.Y = numpy.frombuffer(X, dtype=sample_type).reshape(nframes, target.channels)
+    def read_wav(self, file_name, target):
+        file_name = pathlib.Path(file_name)
 
-            if sample_type == 'int16':
-                convert_16_bit = numpy.float32(2 ** 15 + 1)
-                target.Y = target.Y / convert_16_bit
-            elif sample_type == 'int32':
-                convert_32_bit = numpy.float32(2 ** 31 + 1)
-                target.Y = target.Y / convert_32_bit
-            else:
-                convert_8_bit = numpy.float32(2 ** 8 + 1)
-                target.Y = target.Y / convert_8_bit
+        time_a = time.time_ns()
+
+        try:
+            wav = WavFile(file_name)
+
+            target.channels = wav.channels
+            target.Fs = wav.Fs
+            target.sample_width = wav.sample_width
+            target.Y = wav.read_frames()
+
+            wav.close()
 
             #print_msg( "target.Y: " + str(target.Y.dtype) )
         except:
@@ -131,14 +210,287 @@ class AudioFileReader:
         return True
 
 
+def pcm_to_float(X, sample_width):
+    if sample_width == 2:
+        convert_16_bit = numpy.float32(2 ** 15 + 1)
+        return X / convert_16_bit
+    elif sample_width == 4:
+        convert_32_bit = numpy.float32(2 ** 31 + 1)
+        return X / convert_32_bit
+    else:
+        convert_8_bit = numpy.float32(2 ** 8 + 1)
+        return X / convert_8_bit
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("unexpected end of the wav stream")
+    return data
+
+
+def wav_header_parser():
+    """Parser of the RIFF header of a wav stream, up to the beginning of the data chunk.
+
+    A generator: it yields the number of bytes it needs next and is sent them, it returns
+    (channels, sampling rate, sample width in bytes). Shared by read_wav_header and
+    read_wav_header_async.
+    """
+    riff, _, wave_id = struct.unpack('<4sI4s', (yield 12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError("not a RIFF/WAVE stream")
+
+    fmt = None
+    while True:
+        chunk_id, size = struct.unpack('<4sI', (yield 8))
+        if chunk_id == b'data':
+            break
+        data = yield size + (size & 1)
+        if chunk_id == b'fmt ':
+            fmt = parse_fmt_chunk(data)
+
+    if fmt is None:
+        raise ValueError("fmt chunk not found")
+
+    _, channels, Fs, bits = fmt
+    return channels, Fs, bits // 8
+
+
+def read_wav_header(stream):
+    """Parse the RIFF header of a (non seekable) wav stream and stop at the beginning of the data chunk.
+
+    Returns (channels, sampling rate, sample width in bytes).
+    """
+    parser = wav_header_parser()
+    try:
+        size = next(parser)
+        while True:
+            size = parser.send(read_exactly(stream, size))
+    except StopIteration as e:
+        return e.value
+
+
+async def read_wav_header_async(stream):
+    """read_wav_header for an asyncio.StreamReader (the stdout of an asyncio subprocess)"""
+    parser = wav_header_parser()
+    try:
+        size = next(parser)
+        while True:
+            size = parser.send(await stream.readexactly(size))
+    except StopIteration as e:
+        return e.value
+
+
+def read_pcm_stream(stream, channels, sample_width, capacity=PIPE_BUFFER_FRAMES):
+    """Read the whole PCM stream into a preallocated buffer (grown when it is full) with readinto.
+
+    Returns an array of shape (frames, channels).
+    """
+    dtype = numpy.dtype(f"int{sample_width * 8}")
+    frame_bytes = channels * sample_width
+
+    X = numpy.empty(capacity * channels, dtype=dtype)
+    pos = 0
+
+    while True:
+        if pos == X.nbytes:
+            X.resize(2 * X.size, refcheck=False)
+        n = stream.readinto(memoryview(X).cast('B')[pos:])
+        if not n:
+            break
+        pos += n
+
+    nframes = pos // frame_bytes
+    return X[:nframes * channels].reshape(nframes, channels)
+
+
 class WavFileReader(AudioFileReader):
 
     def read_audio_file_new(self, file_name, target):
         return self.read_wav(file_name, target)
 
+    def open_audio_stream(self, file_name):
+        try:
+            return WavPcmStream(file_name)
+        except:
+            print_msg(f"Unexpected error: {sys.exc_info()}")
+            print_msg("\n - ERROR ! ")
+            return None
+
     def get_cmd(self):
         return ""
 
     def get_cmd_options(self, file_name, tmp_file):
         return ""
 
+
+class SoundfileReader(AudioFileReader):
+    """In-process decoding with libsndfile, the optional soundfile package.
+
+    The pipe of AudioFileReader converts every file to 16 bit at 44.1 kHz: only the files
+    already in this format are opened, the samples (and the sha1 of the track) are then
+    the same as with ffmpeg. The other files are left to the next decoder.
+    """
+
+    @classmethod
+    def available(cls):
+        try:
+            import soundfile
+            return True
+        except:
+            # not installed, or libsndfile is missing
+            return False
+
+    def get_cmd(self):
+        return ""
+
+    def get_cmd_options(self, file_name, tmp_file):
+        return ""
+
+    def open_sound_file(self, file_name):
+        import soundfile
+
+        try:
+            f = soundfile.SoundFile(str(file_name))
+        except:
+            return None
+
+        if f.subtype != 'PCM_16' or f.samplerate != 44100:
+            f.close()
+            return None
+        return f
+
+    def read_audio_file_new(self, file_name, target):
+        stream = self.open_audio_stream(file_name)
+        if stream is None:
+            return False
+
+        try:
+            target.channels = stream.channels
+            target.Fs = stream.Fs
+            target.sample_width = stream.sample_width
+            target.Y = pcm_to_float(stream.read_all(), stream.sample_width)
+        except:
+            return False
+        finally:
+            stream.close()
+
+        return True
+
+    def open_audio_stream(self, file_name):
+        f = self.open_sound_file(file_name)
+        if f is None:
+            return None
+        return SoundfilePcmStream(f)
+
+
+class PcmStream:
+    """Sequential access to the decoded samples of a track.
+
+    The format fields (channels, Fs, sample_width) are valid after the construction,
+    read_chunks yields the samples as float arrays of shape (frames, channels).
+    """
+
+    def __init__(self):
+        self.channels = 0
+        self.Fs = 0
+        self.sample_width = 0
+
+    def read_chunks(self, chunk_frames=STREAM_CHUNK_FRAMES):
+        raise NotImplementedError(f"{type(self).__name__}.read_chunks")
+
+    def close(self):
+        pass
+
+
+class FfmpegPcmStream(PcmStream):
+
+    def __init__(self, proc):
+        PcmStream.__init__(self)
+        self._proc = proc
+
+        try:
+            self.channels, self.Fs, self.sample_width = read_wav_header(proc.stdout)
+        except:
+            self.close()
+            raise
+
+    def read_chunks(self, chunk_frames=STREAM_CHUNK_FRAMES):
+        dtype = numpy.dtype(f"int{self.sample_width * 8}")
+        frame_bytes = self.channels * self.sample_width
+
+        # the same buffer is reused for every chunk
+        X = numpy.empty(chunk_frames * self.channels, dtype=dtype)
+        buf = memoryview(X).cast('B')
+
+        eof = False
+        while not eof:
+            pos = 0
+            while pos < len(buf):
+                n = self._proc.stdout.readinto(buf[pos:])
+                if not n:
+                    eof = True
+                    break
+                pos += n
+
+            nframes = pos // frame_bytes
+            if nframes > 0:
+                yield pcm_to_float(X[:nframes * self.channels].reshape(nframes, self.channels), self.sample_width)
+
+        if self._proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self._proc.returncode}")
+
+    def close(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.stdout.close()
+        self._proc.wait()
+
+
+class WavPcmStream(PcmStream):
+    """The samples of a memory mapped wav file, converted to float one chunk at a time"""
+
+    def __init__(self, file_name, remove=False):
+        PcmStream.__init__(self)
+        self._file_name = pathlib.Path(file_name)
+        self._remove = remove
+
+        self._wav = WavFile(self._file_name)
+        self.channels = self._wav.channels
+        self.Fs = self._wav.Fs
+        self.sample_width = self._wav.sample_width
+
+    def read_chunks(self, chunk_frames=STREAM_CHUNK_FRAMES):
+        for start in range(0, self._wav.frames, chunk_frames):
+            yield self._wav.read_frames(start, start + chunk_frames)
+
+    def close(self):
+        self._wav.close()
+        if self._remove:
+            self._file_name.unlink(missing_ok=True)
+
+
+class SoundfilePcmStream(PcmStream):
+
+    def __init__(self, sound_file):
+        PcmStream.__init__(self)
+        self._file = sound_file
+        self.channels = sound_file.channels
+        self.Fs = sound_file.samplerate
+        self.sample_width = 2
+
+    def read_all(self):
+        return self._file.read(dtype='int16', always_2d=True)
+
+    def read_chunks(self, chunk_frames=STREAM_CHUNK_FRAMES):
+        # the same buffer is reused for every chunk
+        X = numpy.empty((chunk_frames, self.channels), dtype=numpy.int16)
+
+        while True:
+            y = self._file.read(out=X)
+            if y.shape[0] == 0:
+                break
+            yield pcm_to_float(y, self.sample_width)
+
+    def close(self):
+        self._file.close()
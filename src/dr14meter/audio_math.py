@@ -27,6 +27,35 @@ def dr_rms(y):
     return numpy.sqrt(2.0 * numpy.sum(y**2.0, 0) / float(n[0]))
 
 
+def dr_rms_fast(y):
+    """dr_rms of a (samples, ch) array without allocating the array of the squares."""
+    n = y.shape
+    if n[1] == 1:
+        # numpy sums a single column pairwise, einsum would not give the same bits
+        return dr_rms(y)
+    return numpy.sqrt(2.0 * numpy.einsum('ij,ij->j', y, y) / float(n[0]))
+
+
+def block_stats(yb):
+    """Sum of the squares and peak of every block of yb, an array of shape (blocks, samples, ch)."""
+    if yb.shape[2] > 1:
+        sums = numpy.einsum('ijk,ijk->ik', yb, yb)
+    else:
+        sums = numpy.empty((yb.shape[0], 1), dtype=yb.dtype)
+        sq = numpy.empty(yb.shape[1:], dtype=yb.dtype)
+        for i in range(yb.shape[0]):
+            sums[i, :] = numpy.sum(numpy.square(yb[i], out=sq), 0)
+
+    # max/min along an axis with only ch columns is slow: fold m samples in each row first
+    blocks, samples, ch = yb.shape
+    m = max(d for d in range(1, 129) if samples % d == 0)
+    z = yb.reshape(blocks, samples // m, m * ch)
+    peaks = numpy.maximum(numpy.max(z, 1), -numpy.min(z, 1))
+    peaks = numpy.max(peaks.reshape(blocks, m, ch), 1)
+
+    return sums, peaks
+
+
 def u_rms(y):
     n = y.shape
     return numpy.sqrt(numpy.sum(y**2.0, 0) / float(n[0]))
@@ -66,3 +95,36 @@ def sha1_track_v1(y, ext_code=0):
     else:
         shat = hashlib.sha1(y[::100, :] + ext_code).hexdigest()
     return shat
+
+
+class Sha1TrackV1:
+    """Incremental version of sha1_track_v1, the track is pushed in consecutive chunks."""
+
+    SHORT_TRACK = 44100 * 2
+
+    def __init__(self, ext_code=0):
+        self.ext_code = ext_code
+        self.samples = 0
+        self._sha = hashlib.sha1()
+        # the beginning of the track, hashed as a whole if the track is short
+        self._head = []
+
+    def push(self, y):
+        n = y.shape[0]
+
+        if self.samples <= Sha1TrackV1.SHORT_TRACK:
+            self._head.append(y[:Sha1TrackV1.SHORT_TRACK + 1 - self.samples, :].copy())
+        else:
+            self._head = []
+
+        # same rows of y[::100, :] in the whole track
+        offset = -self.samples % 100
+        self._sha.update(y[offset::100, :] + self.ext_code)
+
+        self.samples = self.samples + n
+
+    def hexdigest(self):
+        if self.samples <= Sha1TrackV1.SHORT_TRACK:
+            y = numpy.concatenate(self._head) if self._head else numpy.array([], dtype=numpy.float32)
+            return hashlib.sha1(y + self.ext_code).hexdigest()
+        return self._sha.hexdigest()
@@ -19,7 +19,8 @@
 
 import pathlib
 import numpy
-from dr14meter.audio_file_reader import WavFileReader, AudioFileReader
+from dr14meter.audio_file_reader import STREAM_CHUNK_FRAMES
+from dr14meter.decoders import get_decoders
 
 
 class AudioTrack:
@@ -27,7 +28,8 @@ class AudioTrack:
     # Attention!!! do not modify the order of this list!!!!
     # It is used for computing the sha1 of the track
     FORMATS = ['.flac', '.mp3', '.ogg', '.opus', '.mp4',
-               '.m4a', '.wav', '.wv', '.ape', '.ac3', '.wma', '.dsf', '.dff', '.oga']
+               '.m4a', '.wav', '.wv', '.ape', '.ac3', '.wma', '.dsf', '.dff', '.oga',
+               '.w64', '.rf64']
 
     def __init__(self):
         self.Y = numpy.array([])
@@ -36,6 +38,7 @@ class AudioTrack:
         self.channels = 0
         self.sample_width = 0
         self._ext = -1
+        self._stream = None
 
     def time(self):
         return 1 / self.Fs * self.Y.shape[0]
@@ -43,20 +46,22 @@ class AudioTrack:
     def get_file_ext_code(self):
         return self._ext
 
-    def read_track_new(self, file_name, target):
+    def get_readers(self, file_name):
+        """The decoders of the file, see decoders.py; the next one is tried when a decoder fails"""
         ext = file_name.suffix.lower()
 
         if ext not in AudioTrack.FORMATS:
-            return False
-
-        if ext == '.wav':
-            af = WavFileReader()
-        else:
-            af = AudioFileReader()
+            return []
 
         self._ext = AudioTrack.FORMATS.index(ext)
-        ret_f = af.read_audio_file_new(file_name, target)
-        return ret_f
+        return get_decoders(file_name)
+
+    def read_track_new(self, file_name, target):
+        for af in self.get_readers(file_name):
+            if af.read_audio_file_new(file_name, target):
+                return True
+
+        return False
 
     def open(self, file_name: pathlib.Path):
         file_name = pathlib.Path(file_name)
@@ -70,6 +75,39 @@ class AudioTrack:
 
         return self.read_track_new(file_name, self)
 
+    def open_stream(self, file_name: pathlib.Path):
+        """Open the track for reading it chunk by chunk with read_chunks, Y is left empty."""
+        file_name = pathlib.Path(file_name)
+
+        self.close()
+        self.Y = numpy.array([])
+        self.Fs = 0
+        self.channels = 0
+
+        if not file_name.exists():
+            return False
+
+        for af in self.get_readers(file_name):
+            self._stream = af.open_audio_stream(file_name)
+            if self._stream is not None:
+                break
+
+        if self._stream is None:
+            return False
+
+        self.Fs = self._stream.Fs
+        self.channels = self._stream.channels
+        self.sample_width = self._stream.sample_width
+        return True
+
+    def read_chunks(self, chunk_frames=STREAM_CHUNK_FRAMES):
+        return self._stream.read_chunks(chunk_frames)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
 
 class StructDuration:
 
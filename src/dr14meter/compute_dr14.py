@@ -18,8 +18,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from dr14meter.audio_math import audio_min, max_dynamic, decibel_u, dr_rms
+from dr14meter.audio_math import audio_min, max_dynamic, decibel_u, dr_rms, dr_rms_fast, block_stats, Sha1TrackV1
 from dr14meter.out_messages import dr14_log_debug, dr14_log_info
+from dr14meter.profiler import profile_stage
 
 import numpy as np
 
@@ -27,6 +28,19 @@ import math
 import time
 
 
+BLOCK_TIME = 3
+CUT_BEST_BINS = 0.2
+
+
+def get_block_samples(Fs):
+    if Fs == 44100:
+        delta_fs = 60
+    else:
+        delta_fs = 0
+
+    return BLOCK_TIME * (Fs + delta_fs)
+
+
 def compute_dr14(Y, Fs, duration=None):
 
     s = Y.shape
@@ -36,17 +50,10 @@ def compute_dr14(Y, Fs, duration=None):
     else:
         ch = 1
 
-    if Fs == 44100:
-        delta_fs = 60
-    else:
-        delta_fs = 0
-
     dr14_log_debug("compute_dr14: Y: Fs: %d ; ch: %d ; shape: %d " % (Fs, ch, s[0]))
     time_a = time.time()
 
-    block_time = 3
-    cut_best_bins = 0.2
-    block_samples = block_time * (Fs + delta_fs)
+    block_samples = get_block_samples(Fs)
 
     seg_cnt = int(math.floor(s[0] / block_samples) + 1)
 
@@ -54,15 +61,13 @@ def compute_dr14(Y, Fs, duration=None):
         dr14_log_debug("compute_dr14: EXIT - too short")
         return 0, -100, -100
 
-    curr_sam = 0
+    curr_sam = (seg_cnt - 1) * block_samples
     rms = np.zeros((seg_cnt, ch))
     peaks = np.zeros((seg_cnt, ch))
 
-    for i in range(seg_cnt - 1):
-        rms[i, :] = np.sqrt(2.0 * np.sum(Y[curr_sam:curr_sam + block_samples, :]**2.0, 0) /
-                            float(block_samples))
-        peaks[i, :] = np.max(np.abs(Y[curr_sam:curr_sam + block_samples, :]), 0)
-        curr_sam = curr_sam + block_samples
+    # all the full blocks at once, as a (blocks, samples, ch) view
+    sums, peaks[:-1, :] = block_stats(Y[:curr_sam, :].reshape(seg_cnt - 1, block_samples, ch))
+    rms[:-1, :] = np.sqrt(2.0 * sums / float(block_samples))
 
     i = seg_cnt - 1
 
@@ -70,18 +75,44 @@ def compute_dr14(Y, Fs, duration=None):
         rms[i, :] = dr_rms(Y[curr_sam:s[0] - 1, :])
         peaks[i, :] = np.max(np.abs(Y[curr_sam:s[0] - 1, :]), 0)
 
-    peaks = np.sort(peaks, 0)
-    rms = np.sort(rms, 0)
+    dr14, db_peak = dr14_from_blocks(rms, peaks)
 
-    n_blk = int(math.floor(seg_cnt * cut_best_bins))
+    #y_rms = np.sqrt(np.sum(((np.sum(Y, 1) / 2)**2)) / Y.shape[0])
+
+    y_rms = dr_rms_fast(Y)
+    y_rms = np.mean(y_rms)
+
+    db_rms = decibel_u(y_rms, 1.0)
+
+    if duration is not None:
+        duration.set_samples(s[0], Fs)
+
+    # if Dr_lr is not None:
+    #     Dr_lr = ch_dr14
+
+    time_b = time.time()
+    dr14_log_info("compute_dr14: Clock: %2.8f" % (time_b - time_a))
+
+    return dr14, db_peak, db_rms
+
+
+def dr14_from_blocks(rms, peaks):
+    """DR14 and peak (dB) of a track from the rms and the peak of its blocks, arrays of shape (seg_cnt, ch)."""
+
+    seg_cnt = rms.shape[0]
+
+    n_blk = int(math.floor(seg_cnt * CUT_BEST_BINS))
     if n_blk == 0:
         n_blk = 1
 
-    r = np.arange(seg_cnt - n_blk, seg_cnt)
+    # only the best blocks and the second highest peak are needed, not a full sort;
+    # the best blocks are still sorted, so that they are summed in the same order.
+    rms = np.sort(np.partition(rms, seg_cnt - n_blk, 0)[seg_cnt - n_blk:, :], 0)
+    second_peak = np.partition(peaks, seg_cnt - 2, 0)[seg_cnt - 2, :]
 
-    rms_sum = np.sum(rms[r, :]**2, 0)
+    rms_sum = np.sum(rms**2, 0)
 
-    ch_dr14 = -20.0 * np.log10(np.sqrt(rms_sum / n_blk) * 1.0 / peaks[seg_cnt - 2, :])
+    ch_dr14 = -20.0 * np.log10(np.sqrt(rms_sum / n_blk) * 1.0 / second_peak)
 
     err_i = np.logical_or(rms_sum < audio_min(), np.abs(ch_dr14) > max_dynamic(24))
     ch_dr14[err_i] = 0.0
@@ -90,20 +121,133 @@ def compute_dr14(Y, Fs, duration=None):
 
     db_peak = decibel_u(np.max(peaks), 1.0)
 
-    #y_rms = np.sqrt(np.sum(((np.sum(Y, 1) / 2)**2)) / Y.shape[0])
+    return dr14, db_peak
 
-    y_rms = dr_rms(Y)
-    y_rms = np.mean(y_rms)
 
-    db_rms = decibel_u(y_rms, 1.0)
+class DR14Accumulator:
+    """Incremental version of compute_dr14.
 
-    if duration is not None:
-        duration.set_samples(s[0], Fs)
+    The track is pushed in consecutive chunks of any size, only the current 3s block
+    is kept in memory. finish() returns the same (dr14, dB_peak, dB_rms) of compute_dr14.
 
-    # if Dr_lr is not None:
-    #     Dr_lr = ch_dr14
+    Each chunk is walked once, one block (or part of a block) at a time: all the
+    statistics of a piece are taken while it is still in the cache.
+    """
 
-    time_b = time.time()
-    dr14_log_info("compute_dr14: Clock: %2.8f" % (time_b - time_a))
+    def __init__(self, Fs, ch):
+        self.Fs = Fs
+        self.ch = ch
+        self.block_samples = get_block_samples(Fs)
+        self.samples = 0
 
-    return dr14, db_peak, db_rms
+        self._rms = []
+        self._peaks = []
+
+        # the current (incomplete) block and the sum of squares of the whole track
+        self._block = None
+        self._fill = 0
+        self._sum = None
+        self._scratch = None
+
+    def _init_buffers(self, dtype):
+        self._block = np.empty((self.block_samples, self.ch), dtype=dtype)
+        self._scratch = np.empty((self.block_samples + 1, self.ch), dtype=dtype)
+        self._sum = np.zeros(self.ch, dtype=dtype if self.ch > 1 else np.float64)
+
+    def push(self, Y):
+        n = Y.shape[0]
+
+        if self._block is None:
+            self._init_buffers(Y.dtype)
+
+        i = 0
+        while i < n:
+            k = min(self.block_samples - self._fill, n - i)
+            self._push_piece(Y[i:i + k, :])
+            i = i + k
+
+    def _push_piece(self, Y):
+        # Y is the whole current block or a part of it
+        n = Y.shape[0]
+
+        self._add_squares(Y)
+        self.samples = self.samples + n
+
+        if n == self.block_samples:
+            self._add_blocks(Y[np.newaxis])
+            return
+
+        self._block[self._fill:self._fill + n, :] = Y
+        self._fill = self._fill + n
+
+        if self._fill == self.block_samples:
+            self._add_blocks(self._block[np.newaxis])
+            self._fill = 0
+
+    def _add_squares(self, Y):
+        sq = self._scratch[:Y.shape[0] + 1, :]
+        np.square(Y, out=sq[1:, :])
+
+        if self.ch > 1:
+            # continue the row by row sum done by numpy over the whole track: sum(Y**2, 0)
+            sq[0, :] = self._sum
+            self._sum = np.sum(sq, 0)
+        else:
+            # a single channel is summed pairwise by numpy, keep the partial sums in double precision
+            self._sum = self._sum + np.sum(sq[1:, :], 0, dtype=np.float64)
+
+    def _add_blocks(self, Yb):
+        sums, peaks = block_stats(Yb)
+        self._rms.append(np.sqrt(2.0 * sums / float(self.block_samples)))
+        self._peaks.append(peaks)
+
+    def finish(self, duration=None):
+
+        if self._block is None:
+            self._init_buffers(np.float32)
+
+        # as in compute_dr14 the last sample of the track is not part of the last block
+        tail = self._block[:max(self._fill - 1, 0), :]
+
+        if tail.shape[0] > 0:
+            rms_tail = dr_rms(tail)
+            peak_tail = np.max(np.abs(tail), 0)
+        else:
+            rms_tail = np.zeros(self.ch)
+            peak_tail = np.zeros(self.ch)
+
+        rms = np.concatenate(self._rms + [rms_tail[np.newaxis]], dtype=np.float64)
+        peaks = np.concatenate(self._peaks + [peak_tail[np.newaxis]], dtype=np.float64)
+
+        dr14, db_peak = dr14_from_blocks(rms, peaks)
+
+        y_rms = np.sqrt(2.0 * self._sum.astype(self._block.dtype) / float(self.samples))
+        y_rms = np.mean(y_rms)
+
+        db_rms = decibel_u(y_rms, 1.0)
+
+        if duration is not None:
+            duration.set_samples(self.samples, self.Fs)
+
+        return dr14, db_peak, db_rms
+
+
+class TrackAnalyzer(DR14Accumulator):
+    """DR14, peak, rms and the sha1_track_v1 fingerprint of a track, in a single pass over the samples.
+
+    Without fingerprint the sha1 is None.
+    """
+
+    def __init__(self, Fs, ch, ext_code=0, fingerprint=True):
+        DR14Accumulator.__init__(self, Fs, ch)
+        self.sha1 = Sha1TrackV1(ext_code) if fingerprint else None
+
+    def _push_piece(self, Y):
+        if self.sha1 is not None:
+            with profile_stage('hash'):
+                self.sha1.push(Y)
+        DR14Accumulator._push_piece(self, Y)
+
+    def finish(self, duration=None):
+        dr14, db_peak, db_rms = DR14Accumulator.finish(self, duration)
+        return dr14, db_peak, db_rms, None if self.sha1 is None else self.sha1.hexdigest()
@@ -26,16 +26,115 @@
 # dr.id = DR_Track.iddr group by (dr.dr) ;
 
 import sqlite3
+import sys
 import threading
 import os
 
 from dr14meter.dr14_config import get_db_path
-from dr14meter.out_messages import print_out
+from dr14meter.out_messages import print_out, print_msg
 
 
 unique_db_object = 0
 lock_db = threading.Lock()
 
+DB_CACHE_SIZE_KB = 20000
+DB_CACHED_STATEMENTS = 256
+# rows per index read by analyze
+DB_ANALYSIS_LIMIT = 1000
+# tracks in the database before the first analyze
+DB_ANALYZE_MIN_TRACKS = 1000
+
+# dimension tables cached by the insert sessions: table -> value column
+DB_DIMENSIONS = {'Artist': 'Name', 'Codec': 'Name', 'Genre': 'Name', 'Date': 'Date', 'DR': 'DR'}
+
+# summary tables of the statistics queries (-q hist/evol/codec/top_art): table -> (key column,
+# query computing them from the tracks). They are updated by commit_insert_session.
+DB_AGGREGATES = {
+    'Stat_DR': ('IdDr', """
+        select DR_Track.IdDr , count(*) , sum( dr.dr )
+           from DR_Track inner join dr on dr.id = DR_Track.IdDr
+           group by DR_Track.IdDr """),
+    'Stat_Date': ('IdDate', """
+        select Date_Track.IdDate , count(*) , sum( dr.dr )
+           from Date_Track inner join DR_Track on DR_Track.IdTrack = Date_Track.IdTrack
+                inner join dr on dr.id = DR_Track.IdDr
+           where dr.dr >= 0
+           group by Date_Track.IdDate """),
+    'Stat_Codec': ('IdCodec', """
+        select Codec_Track.IdCodec , count(*) , sum( dr.dr )
+           from Codec_Track inner join DR_Track on DR_Track.IdTrack = Codec_Track.IdTrack
+                inner join dr on dr.id = DR_Track.IdDr
+           group by Codec_Track.IdCodec """),
+    'Stat_Artist': ('IdArtist', """
+        select Artist_Track.IdArtist , count(*) , sum( dr.dr )
+           from Artist_Track inner join DR_Track on DR_Track.IdTrack = Artist_Track.IdTrack
+                inner join dr on dr.id = DR_Track.IdDr
+           group by Artist_Track.IdArtist """),
+}
+
+# the rows of the full text index of the tracks
+DB_SEARCH_ROWS = """
+    select track.id , track.title , Album.title , Artist.name
+       from track left join Album_Track on Album_Track.IdTrack = track.id
+            left join Album on Album.id = Album_Track.IdAlbum
+            left join Artist_Track on Artist_Track.IdTrack = track.id
+            left join Artist on Artist.id = Artist_Track.IdArtist """
+
+# the migrations applied by ungrade_db to the version 1 schema: (version, script), in order
+DB_MIGRATIONS = [
+    # indexes for the joins of database/query.py, the link tables are looked up from the
+    # track or album side and the index contains the other id, so it is a covering one
+    (2, """
+        drop index if exists Album_title_indx ;
+        drop index if exists Track_indx ;
+        create index if not exists Album_title_indx on Album ( Title ) ;
+        create index if not exists DR_Track_track_indx on DR_Track ( IdTrack , IdDr ) ;
+        create index if not exists Codec_Track_track_indx on Codec_Track ( IdTrack , IdCodec ) ;
+        create index if not exists Genre_Track_track_indx on Genre_Track ( IdTrack , IdGenre ) ;
+        create index if not exists Date_Track_track_indx on Date_Track ( IdTrack , IdDate ) ;
+        create index if not exists Artist_Track_track_indx on Artist_Track ( IdTrack , IdArtist ) ;
+        create index if not exists Album_Track_track_indx on Album_Track ( IdTrack , IdAlbum ) ;
+        create index if not exists DR_Album_album_indx on DR_Album ( IdAlbum , IdDr ) ;
+        create index if not exists Artist_Album_album_indx on Artist_Album ( IdAlbum , IdArtist ) ;
+        analyze ;
+    """),
+    # the summary tables, filled with the tracks already in the database
+    (3, "".join(f"""
+        create table {table} (
+            {key} integer primary key ,
+            Tracks integer not null ,
+            DR_Sum integer not null
+        ) ;
+        insert into {table} ( {key} , Tracks , DR_Sum ) {q} ;
+    """ for table, (key, q) in DB_AGGREGATES.items())),
+    # full text index of the tracks (-q search), the rowid is the Id of the track
+    (4, f"""
+        create virtual table Search using fts5 (
+            Title , Album , Artist ,
+            tokenize = 'unicode61 remove_diacritics 2'
+        ) ;
+        insert or replace into Search ( rowid , Title , Album , Artist ) {DB_SEARCH_ROWS} ;
+    """),
+]
+
+
+def open_connection(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+
+    try:
+        # with WAL the readers (-q) do not block a running scan and vice versa
+        conn.execute("pragma journal_mode=WAL")
+    except sqlite3.OperationalError:
+        # read only directory
+        pass
+
+    conn.execute("pragma synchronous=NORMAL")
+    conn.execute(f"pragma cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("pragma temp_store=MEMORY")
+    conn.execute(f"pragma analysis_limit={DB_ANALYSIS_LIMIT}")
+
+    return conn
+
 
 def my_dict_factory(cursor, row):
     d = {}
@@ -51,16 +150,15 @@ class dr_database:
         global unique_db_object
         global lock_db
 
-        lock_db.acquire()
-        if unique_db_object > 0:
-            lock_db.release()
-            raise Exception(
-                "Error: database.dr_database.__init__ database is not unique !")
+        with lock_db:
+            if unique_db_object > 0:
+                raise Exception(
+                    "Error: database.dr_database.__init__ database is not unique !")
 
-        unique_db_object = 1
-        lock_db.release()
+            unique_db_object = 1
 
         self._insert_session = False
+        self._session_db_version = 1
 
         self._tracks = {}
         self._albums = {}
@@ -78,158 +176,275 @@ class dr_database:
         self._id_dr = 0
         self._id_date = 0
 
-        self._current_schema_db_version = 1
-
-    def build_database(self):
-        global lock_db
-        lock_db.acquire()
-        if self._insert_session:
-            lock_db.release()
-            raise Exception(
-                "Error: database.build_database It's impossible to build the database during an insertion !")
-        db = self.dr14_db_main_structure_v1()
-
-        conn = sqlite3.connect(get_db_path())
-
-        conn.executescript(db)
-        conn.commit()
+        self._current_schema_db_version = DB_MIGRATIONS[-1][0]
 
-        self.ungrade_db()
+        # value -> Id of the dimension tables, including the rows of the current session
+        self._dim = {t: {} for t in DB_DIMENSIONS}
+        # the next Id of each table when it was cached
+        self._dim_next_id = {t: None for t in DB_DIMENSIONS}
 
-        lock_db.release()
+        self._local = threading.local()
+        self._connections = []
+        self._lock_conn = threading.Lock()
 
-    def open_insert_session(self):
-        global lock_db
-        lock_db.acquire()
-
-        if self._insert_session:
-            lock_db.release()
-            raise Exception(
-                "Error: database.open_insert_session session already opened !")
-        self._insert_session = True
+    def connection(self):
+        """The connection of the calling thread, it is opened once and kept open.
 
-        self._tracks = {}
-        self._albums = {}
-        self._artists = {}
-        self._genre = {}
-        self._codec = {}
-        self._dr = {}
-        self._date = {}
-
-        self._id_artist = self.query("select max(Id) from Artist").pop()[0]
-        self._id_artist = 0 if self._id_artist == None else self._id_artist + 1
+        close() must be called when the path of the database is changed.
+        """
 
-        self._id_album = self.query("select max(Id) from Album").pop()[0]
-        self._id_album = 0 if self._id_album == None else self._id_album + 1
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
 
-        self._id_track = self.query("select max(Id) from track").pop()[0]
-        self._id_track = 0 if self._id_track == None else self._id_track + 1
+        conn = open_connection(get_db_path())
+        self._local.conn = conn
 
-        self._id_genre = self.query("select max(Id) from Genre").pop()[0]
-        self._id_genre = 0 if self._id_genre == None else self._id_genre + 1
+        with self._lock_conn:
+            self._connections.append(conn)
 
-        self._id_codec = self.query("select max(Id) from Codec").pop()[0]
-        self._id_codec = 0 if self._id_codec == None else self._id_codec + 1
+        return conn
 
-        self._id_dr = self.query("select max(Id) from DR").pop()[0]
-        self._id_dr = 0 if self._id_dr == None else self._id_dr + 1
+    def close(self):
+        """Closes the connections, the next query opens a new one (e.g. after the db file has been moved)."""
 
-        self._id_date = self.query("select max(Id) from Date").pop()[0]
-        self._id_date = 0 if self._id_date == None else self._id_date + 1
+        with self._lock_conn:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
 
-        lock_db.release()
+        self._local = threading.local()
 
-    def commit_insert_session(self):
+    def build_database(self):
         global lock_db
-        lock_db.acquire()
-        if self._insert_session == False:
-            lock_db.release()
-            raise Exception(
-                "Error: database.commit_insert_session the session has not been opened !")
-
-        conn = sqlite3.connect(get_db_path())
-        c = conn.cursor()
+        with lock_db:
+            if self._insert_session:
+                raise Exception(
+                    "Error: database.build_database It's impossible to build the database during an insertion !")
+            db = self.dr14_db_main_structure_v1()
 
-        for k_dr in self._dr.keys():
-            c.execute("insert into DR ( Id , DR ) values ( ? , ? ) ",
-                      (k_dr, self._dr[k_dr]))
+            conn = self.connection()
 
-        for k_artist in self._artists.keys():
-            c.execute("insert into Artist ( Id , Name ) values ( ? , ? ) ",
-                      (k_artist, self._artists[k_artist]))
+            conn.executescript(db)
+            conn.commit()
 
-        for k_codec in self._codec.keys():
-            c.execute("insert into Codec ( Id , Name ) values ( ? , ? ) ",
-                      (k_codec, self._codec[k_codec]))
+            self.ungrade_db()
 
-        for k_genre in self._genre.keys():
-            c.execute("insert into Genre ( Id , Name ) values ( ? , ? ) ",
-                      (k_genre, self._genre[k_genre]))
+    def open_insert_session(self):
+        global lock_db
+        with lock_db:
+            if self._insert_session:
+                raise Exception(
+                    "Error: database.open_insert_session session already opened !")
+            self._insert_session = True
 
-        for k_date in self._date.keys():
-            c.execute("insert into Date ( Id , Date ) values ( ? , ? ) ",
-                      (k_date, self._date[k_date]))
+            self._tracks = {}
+            self._albums = {}
+            self._artists = {}
+            self._genre = {}
+            # the tables written by the session depend on the version (summary tables: 3, search: 4)
+            self._session_db_version = self.db_version
+            self._codec = {}
+            self._dr = {}
+            self._date = {}
 
-        for k_album in self._albums.keys():
-            q = "insert into Album ( Id , sha1 , title <s1> ) values ( :Id , :sha1 , :Title <s2> ) "
+            self._id_artist = self.query("select max(Id) from Artist").pop()[0]
+            self._id_artist = 0 if self._id_artist == None else self._id_artist + 1
 
-            if self._albums[k_album]["disk_nr"] != None:
-                q = q.replace("<s1>", " , disk_nr <s1> ")
-                q = q.replace("<s2>", " , :disk_nr <s2> ")
+            self._id_album = self.query("select max(Id) from Album").pop()[0]
+            self._id_album = 0 if self._id_album == None else self._id_album + 1
 
-            q = q.replace("<s1>", "")
-            q = q.replace("<s2>", "")
+            self._id_track = self.query("select max(Id) from track").pop()[0]
+            self._id_track = 0 if self._id_track == None else self._id_track + 1
 
-            c.execute(q, self._albums[k_album])
+            self._id_genre = self.query("select max(Id) from Genre").pop()[0]
+            self._id_genre = 0 if self._id_genre == None else self._id_genre + 1
 
-            c.execute(
-                "insert into DR_Album ( IdDr , IdAlbum ) values ( :dr_id , :Id )",  self._albums[k_album])
+            self._id_codec = self.query("select max(Id) from Codec").pop()[0]
+            self._id_codec = 0 if self._id_codec == None else self._id_codec + 1
 
-            if self._albums[k_album]["artist_id"] >= 0:
-                c.execute(
-                    "insert into Artist_Album ( IdArtist , IdAlbum ) values ( :artist_id , :Id ) ", self._albums[k_album])
+            self._id_dr = self.query("select max(Id) from DR").pop()[0]
+            self._id_dr = 0 if self._id_dr == None else self._id_dr + 1
 
-        for k_track in self._tracks.keys():
+            self._id_date = self.query("select max(Id) from Date").pop()[0]
+            self._id_date = 0 if self._id_date == None else self._id_date + 1
 
-            q = """insert into Track  ( Id  ,  Title  , rms   , peak  , duration  , bit  , bitrate  , sampling_rate  , sha1  , size  <1s> ) 
-                               values ( :id , :title  , :rms  , :peak , :duration , :bit , :bitrate , :sampling_rate , :sha1 , :size <2s> ) 
-                """
-            if self._tracks[k_track].get("track_nr", None) != None:
-                q = q.replace("<1s>", " , track_nr <1s> ")
-                q = q.replace("<2s>", " , :track_nr <2s> ")
+            self.__load_dimensions({'Artist': self._id_artist, 'Codec': self._id_codec, 'Genre': self._id_genre,
+                                    'Date': self._id_date, 'DR': self._id_dr})
 
-            q = q.replace("<1s>", "")
-            q = q.replace("<2s>", "")
+    def __load_dimensions(self, next_ids):
+        """Loads the dimension tables changed since they were cached, by another process too"""
 
-            c.execute(q, self._tracks[k_track])
+        for table, column in DB_DIMENSIONS.items():
+            if self._dim_next_id[table] == next_ids[table]:
+                continue
 
-            c.execute(
-                "insert into DR_Track ( IdDr , IdTrack ) values ( :dr_id , :id )", self._tracks[k_track])
+            # if a value is repeated the last Id is used, as the previous per track selects did
+            rows = self.query(f"select Id , {column} from {table} order by Id")
+            self._dim[table] = {v: i for (i, v) in rows}
+            self._dim_next_id[table] = next_ids[table]
 
-            c.execute(
-                "insert into Codec_Track ( IdCodec , IdTrack ) values ( :codec_id , :id )", self._tracks[k_track])
+    def __dimension_id(self, table, value, insert_f):
+        i = self._dim[table].get(value)
+        if i is None:
+            i = insert_f(value)
+            self._dim[table][value] = i
+        return i
 
-            if self._tracks[k_track]["genre_id"] >= 0:
-                c.execute(
-                    "insert into Genre_Track ( IdGenre , IdTrack ) values ( :genre_id , :id ) ", self._tracks[k_track])
+    def commit_insert_session(self):
+        global lock_db
+        with lock_db:
+            self.__commit_insert_session()
 
-            if self._tracks[k_track]["date_id"] >= 0:
-                c.execute(
-                    "insert into Date_Track ( IdDate , IdTrack ) values ( :date_id , :id ) ",  self._tracks[k_track])
+    def abort_insert_session(self):
+        """Discards the rows inserted since open_insert_session"""
+        global lock_db
+        with lock_db:
+            if self._insert_session:
+                # the cached dimensions contain the rows of the session
+                self._dim_next_id = {t: None for t in DB_DIMENSIONS}
+                self._insert_session = False
 
-            if self._tracks[k_track]["artist_id"] >= 0:
-                c.execute(
-                    "insert into Artist_Track ( IdArtist , IdTrack ) values ( :artist_id , :id ) ", self._tracks[k_track])
+    def __commit_insert_session(self):
+        if self._insert_session == False:
+            raise Exception(
+                "Error: database.commit_insert_session the session has not been opened !")
 
-            if self._tracks[k_track]["album_id"] >= 0:
-                c.execute(
-                    "insert into Album_Track ( IdAlbum , IdTrack ) values ( :album_id , :id ) ", self._tracks[k_track])
+        conn = self.connection()
+        c = conn.cursor()
 
-        conn.commit()
-        conn.close()
+        tracks = list(self._tracks.values())
+        albums = list(self._albums.values())
+
+        try:
+            c.execute("begin")
+
+            c.executemany("insert into DR ( Id , DR ) values ( ? , ? ) ", self._dr.items())
+            c.executemany("insert into Artist ( Id , Name ) values ( ? , ? ) ", self._artists.items())
+            c.executemany("insert into Codec ( Id , Name ) values ( ? , ? ) ", self._codec.items())
+            c.executemany("insert into Genre ( Id , Name ) values ( ? , ? ) ", self._genre.items())
+            c.executemany("insert into Date ( Id , Date ) values ( ? , ? ) ", self._date.items())
+
+            c.executemany("insert into Album ( Id , sha1 , title , disk_nr ) values ( ? , ? , ? , ? ) ",
+                          [(a["Id"], a["sha1"], a["Title"], a["disk_nr"]) for a in albums])
+            c.executemany("insert into DR_Album ( IdDr , IdAlbum ) values ( ? , ? )",
+                          [(a["dr_id"], a["Id"]) for a in albums])
+            c.executemany("insert into Artist_Album ( IdArtist , IdAlbum ) values ( ? , ? ) ",
+                          [(a["artist_id"], a["Id"]) for a in albums if a["artist_id"] >= 0])
+
+            c.executemany("""insert into Track  ( Id , Title , rms , peak , duration , bit , bitrate , sampling_rate , sha1 , size , track_nr )
+                                          values ( ? , ? , ? , ? , ? , ? , ? , ? , ? , ? , ? ) """,
+                          [(t["id"], t["title"], t["rms"], t["peak"], t["duration"], t["bit"], t["bitrate"],
+                            t["sampling_rate"], t["sha1"], t["size"], t["track_nr"]) for t in tracks])
+
+            c.executemany("insert into DR_Track ( IdDr , IdTrack ) values ( ? , ? )",
+                          [(t["dr_id"], t["id"]) for t in tracks])
+            c.executemany("insert into Codec_Track ( IdCodec , IdTrack ) values ( ? , ? )",
+                          [(t["codec_id"], t["id"]) for t in tracks])
+
+            # -1: no genre, date, artist or album; None: album not found
+            for table, col, key in [("Genre_Track", "IdGenre", "genre_id"), ("Date_Track", "IdDate", "date_id"),
+                                    ("Artist_Track", "IdArtist", "artist_id"), ("Album_Track", "IdAlbum", "album_id")]:
+                c.executemany(f"insert into {table} ( {col} , IdTrack ) values ( ? , ? ) ",
+                              [(t[key], t["id"]) for t in tracks if t[key] is not None and t[key] >= 0])
+
+            deltas = self.__aggregate_deltas(tracks) if self._session_db_version >= 3 else {}
+            for table, rows in deltas.items():
+                key = DB_AGGREGATES[table][0]
+                c.executemany(f"""insert into {table} ( {key} , Tracks , DR_Sum ) values ( ? , ? , ? )
+                                     on conflict ( {key} ) do update
+                                     set Tracks = Tracks + excluded.Tracks , DR_Sum = DR_Sum + excluded.DR_Sum """,
+                              [(k, n, dr_sum) for k, (n, dr_sum) in rows.items()])
+
+            if self._session_db_version >= 4:
+                # the same rows as DB_SEARCH_ROWS
+                c.executemany("insert or replace into Search ( rowid , Title , Album , Artist ) values ( ? , ? , ? , ? )",
+                              [(t["id"], t["title"], t["album_title"], t["artist"]) for t in tracks])
+
+            conn.commit()
+
+            self._dim_next_id = {'Artist': self._id_artist, 'Codec': self._id_codec, 'Genre': self._id_genre,
+                                 'Date': self._id_date, 'DR': self._id_dr}
+        except:
+            # the connection is kept open, a partial session must not be committed later
+            conn.rollback()
+            # the cached dimensions contain the rows of the session
+            self._dim_next_id = {t: None for t in DB_DIMENSIONS}
+            raise
+        finally:
+            c.close()
+            self._insert_session = False
+
+        # the session is committed: a failure here (e.g. database locked by a reader) must not fail it,
+        # the statistics are refreshed by a next session
+        try:
+            self.__refresh_statistics(conn)
+        except:
+            if conn.in_transaction:
+                conn.rollback()
+            print_msg(f"Local database: unable to refresh the statistics: {sys.exc_info()[1]}")
+
+    def __aggregate_deltas(self, tracks):
+        """The rows added to the summary tables by the tracks: table -> key -> [tracks, dr sum]"""
+
+        deltas = {table: {} for table in DB_AGGREGATES}
+
+        def add(table, k, dr):
+            d = deltas[table].setdefault(k, [0, 0])
+            d[0] = d[0] + 1
+            d[1] = d[1] + dr
+
+        # as the queries of DB_AGGREGATES: -1 is no date or artist
+        for t in tracks:
+            dr = int(t["dr"])
+            add('Stat_DR', t["dr_id"], dr)
+            add('Stat_Codec', t["codec_id"], dr)
+            if t["date_id"] >= 0 and dr >= 0:
+                add('Stat_Date', t["date_id"], dr)
+            if t["artist_id"] >= 0:
+                add('Stat_Artist', t["artist_id"], dr)
+
+        return deltas
+
+    def check_aggregates(self):
+        """The summary tables that differ from the tracks in the database"""
 
-        self._insert_session = False
-        lock_db.release()
+        global lock_db
+        with lock_db:
+            bad = []
+            for table, (key, q) in DB_AGGREGATES.items():
+                stored = self.query(f"select {key} , Tracks , DR_Sum from {table} where Tracks > 0 order by {key}")
+                computed = self.query(f"{q} order by 1")
+                if stored != computed:
+                    bad.append(table)
+            return bad
+
+    def rebuild_aggregates(self):
+        global lock_db
+        with lock_db:
+            conn = self.connection()
+            try:
+                conn.execute("begin")
+                for table, (key, q) in DB_AGGREGATES.items():
+                    conn.execute(f"delete from {table}")
+                    conn.execute(f"insert into {table} ( {key} , Tracks , DR_Sum ) {q}")
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+
+    def __refresh_statistics(self, conn):
+        """Runs analyze when the tracks have doubled since the last one, the query plans depend on it"""
+
+        r = None
+        # sqlite_stat1 is created by the first analyze
+        if conn.execute("select 1 from sqlite_master where name = 'sqlite_stat1'").fetchone() is not None:
+            r = conn.execute("select stat from sqlite_stat1 where tbl = 'Track'").fetchone()
+        analyzed = 0 if r is None else int(r[0].split()[0])
+
+        if self._id_track > 2 * analyzed + DB_ANALYZE_MIN_TRACKS:
+            conn.execute("analyze")
+            conn.commit()
 
     def insert_track(self, track_sha1, title,
                      dr, rms, peak, duration,
@@ -238,152 +453,94 @@ class dr_database:
                      genre=None, date=None, track_nr=None, size=None):
 
         global lock_db
-        lock_db.acquire()
-        if self._insert_session == False:
-            lock_db.release()
-            raise Exception(
-                "Error: database.insert_track the insert session has not been opened !")
-
-        q = "select Id from track where sha1 = ? "
-        rq = self.query(q, (track_sha1,))
-
-        if len(rq) > 0:
-            lock_db.release()
-            return rq.pop()[0]
-
-        #print("insert: " + title )
-
-        artist_id = -1
-        if artist != None:
-            q = "select Id from artist where name = ? "
-            rq = self.query(q, (artist, ))
-            if len(rq) == 0 and not (artist in self._artists.values()):
-                artist_id = self.__insert_artist(artist)
-            elif len(rq) > 0:
-                artist_id = rq.pop()[0]
-            else:
-                artist_id = [k for (k, v) in self._artists.items() if v == artist][
-                    0]
-
-        q = "select Id from codec where name = ? "
-        rq = self.query(q, (codec, ))
-        if len(rq) == 0 and not (codec in self._codec.values()):
-            codec_id = self.__insert_codec(codec)
-        elif len(rq) > 0:
-            codec_id = rq.pop()[0]
-        else:
-            codec_id = [k for (k, v) in self._codec.items() if v == codec][0]
-
-        genre_id = -1
-        if genre != None:
-            q = "select Id from Genre where name = ? "
-            rq = self.query(q, (genre,))
-            if len(rq) == 0 and not (genre in self._genre.values()):
-                genre_id = self.__insert_genre(genre)
-            elif len(rq) > 0:
-                genre_id = rq.pop()[0]
-            else:
-                genre_id = [k for (k, v) in self._genre.items() if v == genre][
-                    0]
-
-        date_id = -1
-        if date != None:
-            date_nr = int(float(date))
-            q = "select Id from Date where date = ? "
-            rq = self.query(q, (date_nr, ))
-            if len(rq) == 0 and not (date_nr in self._date.values()):
-                date_id = self.__insert_date(date_nr)
-            elif len(rq) > 0:
-                date_id = rq.pop()[0]
-            else:
-                date_id = [k for (k, v) in self._date.items()
-                           if v == date_nr][0]
-
-        q = "select Id from DR where DR = ? "
-        rq = self.query(q, (dr,))
-        if len(rq) == 0 and not (dr in self._dr.values()):
-            dr_id = self.__insert_dr(dr)
-        elif len(rq) > 0:
-            dr_id = rq.pop()[0]
-        else:
-            dr_id = [k for (k, v) in self._dr.items() if v == dr][0]
+        with lock_db:
+            if self._insert_session == False:
+                raise Exception(
+                    "Error: database.insert_track the insert session has not been opened !")
+
+            q = "select Id from track where sha1 = ? "
+            rq = self.query(q, (track_sha1,))
+
+            if len(rq) > 0:
+                return rq.pop()[0]
+
+            # the session can contain several albums
+            if track_sha1 in self._tracks:
+                return self._tracks[track_sha1]["id"]
 
-        album_id = -1
-        if album_sha1 != None:
-            rq = self.query(
-                "select Id from Album where sha1 = ? ", (album_sha1, ))
-            if len(rq) == 0 and not album_sha1 in [k for k in self._albums.keys()]:
-                album_id = None
-            elif len(rq) > 0:
-                album_id = rq.pop()[0]
-            else:
-                album_id = [self._albums[k]["Id"]
-                            for k in self._albums.keys() if k == album_sha1][0]
+            #print("insert: " + title )
 
-        self._tracks[track_sha1] = {"id": self._id_track, "sha1": track_sha1, "title": title, "dr_id": dr_id,
-                                    "peak": peak, "rms": rms, "duration": duration,
-                                    "codec_id": codec_id, "album_sha1": album_sha1, "artist_id": artist_id,
-                                    "genre_id": genre_id, "date_id": date_id, "album_id": album_id, "track_nr": track_nr,
-                                    "bit": bit, "bitrate": bitrate, "sampling_rate": sampling_rate, "size": size}
+            artist_id = -1
+            if artist != None:
+                artist_id = self.__dimension_id('Artist', artist, self.__insert_artist)
 
-        self._id_track = self._id_track + 1
+            codec_id = self.__dimension_id('Codec', codec, self.__insert_codec)
 
-        lock_db.release()
+            genre_id = -1
+            if genre != None:
+                genre_id = self.__dimension_id('Genre', genre, self.__insert_genre)
 
-        return self._id_track - 1
+            date_id = -1
+            if date != None:
+                date_id = self.__dimension_id('Date', int(float(date)), self.__insert_date)
+
+            dr_id = self.__dimension_id('DR', dr, self.__insert_dr)
+
+            album_id = -1
+            album_title = None
+            if album_sha1 != None:
+                if album_sha1 in self._albums:
+                    album_id = self._albums[album_sha1]["Id"]
+                    album_title = self._albums[album_sha1]["Title"]
+                else:
+                    rq = self.query(
+                        "select Id , Title from Album where sha1 = ? ", (album_sha1, ))
+                    (album_id, album_title) = rq.pop() if len(rq) > 0 else (None, None)
+
+            self._tracks[track_sha1] = {"id": self._id_track, "sha1": track_sha1, "title": title, "dr_id": dr_id, "dr": dr,
+                                        "peak": peak, "rms": rms, "duration": duration,
+                                        "codec_id": codec_id, "album_sha1": album_sha1, "album_title": album_title,
+                                        "artist_id": artist_id, "artist": artist,
+                                        "genre_id": genre_id, "date_id": date_id, "album_id": album_id, "track_nr": track_nr,
+                                        "bit": bit, "bitrate": bitrate, "sampling_rate": sampling_rate, "size": size}
+
+            self._id_track = self._id_track + 1
+
+            return self._id_track - 1
 
     def insert_album(self, album_sha1, title, dr, disk_nr=None, artist=None):
         global lock_db
-        lock_db.acquire()
-
-        #print( album_sha1 )
-        q = "select Id from Album where sha1 = ? "
-        rq = self.query(q, (album_sha1, ))
-
-        if len(rq) > 0:
-            lock_db.release()
-            return rq.pop()[0]
-
-        q = "select Id from DR where DR = ? "
-        rq = self.query(q, (dr,))
-        if len(rq) == 0 and not (dr in self._dr.values()):
-            dr_id = self.__insert_dr(dr)
-        elif len(rq) > 0:
-            dr_id = rq.pop()[0]
-        else:
-            dr_id = [k for (k, v) in self._dr.items() if v == dr][0]
+        with lock_db:
+            #print( album_sha1 )
+            q = "select Id from Album where sha1 = ? "
+            rq = self.query(q, (album_sha1, ))
+
+            if len(rq) > 0:
+                return rq.pop()[0]
+
+            if album_sha1 in self._albums:
+                return self._albums[album_sha1]["Id"]
 
-        artist_id = -1
-        print(artist)
-        if artist != None:
-            q = "select Id from artist where name = ? "
-            rq = self.query(q, (artist,))
-            if len(rq) == 0 and not (artist in self._artists.values()):
-                artist_id = self.__insert_artist(artist)
-            elif len(rq) > 0:
-                artist_id = rq.pop()[0]
-            else:
-                artist_id = [
-                    k for (k, v) in self._artists.items() if v == artist]
+            dr_id = self.__dimension_id('DR', dr, self.__insert_dr)
 
-        self._albums[album_sha1] = {"Id": self._id_album, "sha1": album_sha1,
-                                    "Title": title, "dr_id": dr_id,
-                                    "disk_nr": disk_nr, "artist_id": artist_id}
+            artist_id = -1
+            if artist != None:
+                artist_id = self.__dimension_id('Artist', artist, self.__insert_artist)
 
-        self._id_album = self._id_album + 1
+            self._albums[album_sha1] = {"Id": self._id_album, "sha1": album_sha1,
+                                        "Title": title, "dr_id": dr_id,
+                                        "disk_nr": disk_nr, "artist_id": artist_id}
 
-        lock_db.release()
+            self._id_album = self._id_album + 1
 
-        return self._id_album - 1
+            return self._id_album - 1
 
     def query(self, query, t=(), dict_factory_arg=None):
 
-        conn = sqlite3.connect(get_db_path())
+        c = self.connection().cursor()
 
         if dict_factory_arg != None:
-            conn.row_factory = dict_factory_arg
-
-        c = conn.cursor()
+            c.row_factory = dict_factory_arg
 
         c.execute(query, t)
         res_l = c.fetchall()
@@ -571,26 +728,37 @@ class dr_database:
 
         return db
 
-    def ungrade_db(self):
-        if self._current_schema_db_version == self.db_version:
+    def ungrade_db(self, target=None):
+        """Applies the migrations newer than the version of the database, up to target (default the last one),
+        each one in a transaction"""
+
+        version = self.db_version
+
+        if target is None:
+            target = self._current_schema_db_version
+
+        if target == version:
             return
 
-        #
-        # upgrade db here.
-        #
+        conn = self.connection()
 
-        return
+        for (v, script) in DB_MIGRATIONS:
+            if v <= version or v > target:
+                continue
+            try:
+                conn.executescript(
+                    f"begin ; {script} insert into Db_Version ( Version ) values ( {v} ) ; commit ;")
+            except:
+                conn.rollback()
+                raise
 
     def dump(self):
         global lock_db
-        lock_db.acquire()
-
-        conn = sqlite3.connect(get_db_path())
-
-        for line in conn.iterdump():
-            print_out('%s\n' % line)
+        with lock_db:
+            conn = self.connection()
 
-        lock_db.release()
+            for line in conn.iterdump():
+                print_out('%s\n' % line)
 
     # privates methods:
     def __insert_artist(self, name):
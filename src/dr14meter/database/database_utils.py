@@ -21,12 +21,10 @@
 import os
 
 from dr14meter.table import *  # ExtendedTextTable
-from dr14meter.audio_analysis import *
 import dr14meter.dr14_global as dr14
 from dr14meter.dr14_config import *  # get_db_path, enable_db, database_exists
 from dr14meter.write_dr import WriteDr, WriteDrExtended
 from dr14meter.out_messages import *  # print_out, print_err
-from dr14meter.dr14_utils import test_path_validity
 
 from dr14meter.database.database import dr_database_singletone
 from dr14meter.database.query import *
@@ -36,6 +34,7 @@ import re
 
 
 def local_dr_database_configure():
+    from dr14meter.dr14_utils import test_path_validity
 
     print_out("---------------------------------------------------------------------------------------------- ")
     print_out(f"- {dr14.get_exe_name()} --  ")
@@ -121,6 +120,7 @@ def fix_problematic_database():
     if nr == 1:
         if os.path.isfile(dbp):
             dest_file = dbp + ".d_save"
+            dr_database_singletone().get().close()
             os.rename(dbp, dest_file)
             print_out("  ")
             print_out(" The old database has been saved in the file: %s " % dest_file)
@@ -150,6 +150,7 @@ def enable_database(prompt=True):
         if not f:
             dbp = get_db_path()
             dest_file = dbp + ".de_save"
+            db.close()
             os.rename(dbp, dest_file)
         else:
             f = True
@@ -174,6 +175,7 @@ def enable_database(prompt=True):
 
         print_msg("Preparing database .... ")
         db = dr_database_singletone().get()
+        db.close()
         db.build_database()
         f = db.is_db_valid()
 
@@ -185,6 +187,26 @@ def enable_database(prompt=True):
     return
 
 
+def check_database():
+    db = dr_database_singletone().get()
+
+    # the summary tables are created by the migration 3, main() has upgraded the database
+    if db.db_version < STATS_DB_VERSION:
+        print_err(f"the database has not been upgraded to the version {STATS_DB_VERSION}, "
+                  f"it has no statistics tables to check")
+        return
+
+    bad = db.check_aggregates()
+
+    if len(bad) == 0:
+        print_msg("The statistics tables of the database are consistent")
+        return
+
+    print_msg(f"The statistics tables {', '.join(bad)} are not consistent with the tracks, rebuilding ...")
+    db.rebuild_aggregates()
+    print_msg("Done")
+
+
 def input_number(p=" > ", rng=(0, 2**31)):
 
     flag = True
@@ -246,6 +268,7 @@ def query_helper():
     print_out(" 6. The list of the worst DR albums ")
     print_out(" 7. The DR histogram ")
     print_out(" 8. Used audio CODEC and mean DR ")
+    print_out(" 9. Search the tracks by title, album or artist ")
     print_out(" 0. Exit ")
     print_out("  ")
 
@@ -282,6 +305,9 @@ def query_helper():
         options.query = ["hist"]
     elif nr == 8:
         options.query = ["codec"]
+    elif nr == 9:
+        print_out(" Insert the words to search: ")
+        options.query = ["search"] + input(" > ").split()
 
     for e in ext_opt:
         options.query.append(e)
@@ -300,6 +326,9 @@ def query_helper():
 
 def database_exec_query(options, tm=ExtendedTextTable()):
 
+    if options.query[0] == "search":
+        return database_exec_search(options.query[1:], tm)
+
     if len(options.query) >= 2:
         limit = int(options.query[1])
     else:
@@ -358,3 +387,23 @@ def database_exec_query(options, tm=ExtendedTextTable()):
         q.exec_query(), tm, table_title, q.get_col_keys())
 
     return table_code
+
+
+def database_exec_search(terms, tm=ExtendedTextTable()):
+
+    q = query_search(terms)
+
+    if q.terms == "":
+        print_err("-q search requires the terms to search, e.g. -q search pink floyd")
+        return None
+
+    if not has_search_table():
+        if not has_fts5():
+            print_err("-q search requires the FTS5 module of SQLite, the sqlite3 module of Python is built without it")
+        else:
+            print_err(f"-q search requires the full-text index of the database version {SEARCH_DB_VERSION}, "
+                      f"the upgrade of the database has failed")
+        return None
+
+    wr = WriteDr()
+    return wr.write_query_result(q.exec_query(), tm, f"Search: {' '.join(terms)}", q.get_col_keys())
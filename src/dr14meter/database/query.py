@@ -23,6 +23,11 @@ import sys
 from dr14meter.database.database import dr_database_singletone
 
 
+# the summary tables (Stat_*) are created by the migration 3, the Search table by the migration 4
+STATS_DB_VERSION = 3
+SEARCH_DB_VERSION = 4
+
+
 def my_dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
@@ -64,6 +69,24 @@ class query:
         return self.keys
 
 
+def has_stats_tables():
+    """False if the database has not been upgraded to the summary tables, the queries then join the tracks"""
+    return dr_database_singletone().get().db_version >= STATS_DB_VERSION
+
+
+def has_search_table():
+    """False if the full-text index (-q search) is missing: the migration 4 has not been applied or it failed"""
+    db = dr_database_singletone().get()
+    return db.db_version >= SEARCH_DB_VERSION and \
+        len(db.query("select 1 from sqlite_master where name = 'Search'")) > 0
+
+
+def has_fts5():
+    """True if the SQLite library has the fts5 module of the Search table"""
+    db = dr_database_singletone().get()
+    return any(r[0] == 'ENABLE_FTS5' for r in db.query("pragma compile_options"))
+
+
 class query_top_dr(query):
 
     def __init__(self):
@@ -168,13 +191,13 @@ class query_top_artists(query):
         return db.query(self.get_query(), (self.min_track, self.limit), dict_factory_arg=my_dict_factory)
 
     def get_query(self):
-        q = """
+        if not has_stats_tables():
+            return """
         select Artist, Mean_DR , Track_Count from 
         ( 
-            select artist.name as Artist , avg( dr.dr ) as Mean_DR , count( track.id ) as Track_Count
-               from track inner join DR_Track on DR_Track.idtrack = track.id 
+            select artist.name as Artist , avg( dr.dr ) as Mean_DR , count( Artist_Track.IdTrack ) as Track_Count
+               from Artist_Track inner join DR_Track on DR_Track.idtrack = Artist_Track.idtrack
                       inner join dr on dr.id = DR_Track.iddr 
-                      inner join Artist_Track on Artist_Track.idtrack = track.id
                       inner join Artist on Artist.id = Artist_Track.IdArtist
                       group by artist                  
         )
@@ -183,6 +206,19 @@ class query_top_artists(query):
         limit ? ;
         """
 
+        q = """
+        select Artist, Mean_DR , Track_Count from 
+        ( 
+            select artist.name as Artist , sum( Stat_Artist.DR_Sum ) * 1.0 / sum( Stat_Artist.Tracks ) as Mean_DR ,
+                   sum( Stat_Artist.Tracks ) as Track_Count
+               from Stat_Artist inner join Artist on Artist.id = Stat_Artist.IdArtist
+                      group by artist                  
+        )
+        where Track_Count >= ? 
+        order by mean_dr desc  
+        limit ? ;
+        """
+
         return q
 
 
@@ -197,7 +233,8 @@ class query_dr_histogram(query):
         return db.query(self.get_query(), (), dict_factory_arg=my_dict_factory)
 
     def get_query(self):
-        q = """
+        if not has_stats_tables():
+            return """
         select dr.dr as DR , count(dr.dr) as Freq 
             from  DR_Track inner join dr on dr.id = DR_Track.iddr
             where dr.dr >= 0 
@@ -205,6 +242,14 @@ class query_dr_histogram(query):
             order by (dr) ;
         """
 
+        q = """
+        select dr.dr as DR , sum( Stat_DR.Tracks ) as Freq 
+            from  Stat_DR inner join dr on dr.id = Stat_DR.IdDr
+            where dr.dr >= 0 and Stat_DR.Tracks > 0
+            group by (dr.dr) 
+            order by (dr) ;
+        """
+
         return q
 
 
@@ -219,17 +264,25 @@ class query_date_dr_evolution(query):
         return db.query(self.get_query(), (), dict_factory_arg=my_dict_factory)
 
     def get_query(self):
-        q = """
+        if not has_stats_tables():
+            return """
         select date.date as Date , avg( dr.dr ) as Mean
-           from track inner join DR_Track on DR_Track.idtrack = track.id 
+           from Date_Track inner join DR_Track on DR_Track.idtrack = Date_Track.idtrack
                   inner join dr on dr.id = DR_Track.iddr
-                  inner join Date_Track on Date_Track.idtrack = track.id
                   inner join date on date.id = Date_Track.iddate
                   where dr.dr >= 0  
                   group by date 
                   order by date ;
         """
 
+        q = """
+        select date.date as Date , sum( Stat_Date.DR_Sum ) * 1.0 / sum( Stat_Date.Tracks ) as Mean
+           from Stat_Date inner join date on date.id = Stat_Date.IdDate
+                  where Stat_Date.Tracks > 0
+                  group by date 
+                  order by date ;
+        """
+
         return q
 
 
@@ -244,14 +297,71 @@ class query_dr_codec(query):
         return db.query(self.get_query(), (), dict_factory_arg=my_dict_factory)
 
     def get_query(self):
-        q = """
+        if not has_stats_tables():
+            return """
         select codec.name as Codec , avg( dr.dr ) as Mean_DR , count( Codec_Track.IdCodec ) as Codec_Freq 
-           from track inner join DR_Track on DR_Track.idtrack = track.id 
+           from Codec_Track inner join DR_Track on DR_Track.idtrack = Codec_Track.idtrack
                   inner join dr on dr.id = DR_Track.iddr 
-                  inner join Codec_Track on Codec_Track.idtrack = track.id
                   inner join Codec on Codec.id = Codec_Track.IdCodec 
                   group by name 
                   order by mean_dr desc ;  
         """
 
+        q = """
+        select codec.name as Codec , sum( Stat_Codec.DR_Sum ) * 1.0 / sum( Stat_Codec.Tracks ) as Mean_DR ,
+               sum( Stat_Codec.Tracks ) as Codec_Freq 
+           from Stat_Codec inner join Codec on Codec.id = Stat_Codec.IdCodec
+                  where Stat_Codec.Tracks > 0 
+                  group by name 
+                  order by mean_dr desc ;  
+        """
+
         return q
+
+
+class query_search(query):
+
+    def __init__(self, terms=()):
+        query.__init__(self)
+        self.keys = ["DR", "Title", "Artist", "Album"]
+        self.append_parameter(search_expression(terms))
+
+    def set_terms(self, terms):
+        self.set_parameter(1, search_expression(terms))
+
+    def get_terms(self):
+        return self.get_parameter(1)
+
+    terms = property(get_terms, set_terms)
+
+    def exec_query(self):
+        db = dr_database_singletone().get()
+        return db.query(self.get_query(), (self.terms, self.limit), dict_factory_arg=my_dict_factory)
+
+    def get_query(self):
+        q = """
+        select track.id as id , Search.Title as Title , dr.dr as DR , Search.Album as Album , Search.Artist as Artist
+           from Search inner join track on track.id = Search.rowid
+                inner join DR_Track on DR_Track.idtrack = Search.rowid
+                inner join dr on dr.id = DR_Track.iddr
+                where Search match ?
+                order by Search.rank
+                limit ? ;
+        """
+
+        return q
+
+
+def search_expression(terms):
+    """The fts5 query matching all the terms, a term ending with * is a prefix"""
+
+    expr = []
+    for t in " ".join(terms).split():
+        prefix = t.endswith('*')
+        t = t.rstrip('*')
+        if len(t) == 0:
+            continue
+        t = '"' + t.replace('"', '""') + '"'
+        expr.append(t + '*' if prefix else t)
+
+    return " ".join(expr)
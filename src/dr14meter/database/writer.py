@@ -0,0 +1,161 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Background writer of the local DR database.
+#
+# The albums are queued as plain records (WriteDr.album_record) by any thread and
+# written by a single thread, several albums in one transaction. The queue is bounded:
+# the scan waits when the database cannot keep up.
+
+import queue
+import sys
+import threading
+import time
+
+from dr14meter.database.database import dr_database_singletone
+from dr14meter.profiler import profile_stage
+from dr14meter.out_messages import print_msg
+
+
+DB_WRITER_QUEUE_SIZE = 256
+# albums per transaction
+DB_WRITER_BATCH = 64
+# seconds an album can wait in a partial batch
+DB_WRITER_INTERVAL = 2.0
+
+db_writer = None
+lock_writer = threading.Lock()
+
+
+def start_db_writer():
+    global db_writer
+    with lock_writer:
+        if db_writer is None:
+            db_writer = DatabaseWriter()
+            db_writer.start()
+        return db_writer
+
+
+def get_db_writer():
+    """The running writer or None, the albums are then written by the caller"""
+    return db_writer
+
+
+def stop_db_writer():
+    """Writes the queued albums and stops the writer"""
+    global db_writer
+    with lock_writer:
+        w = db_writer
+        db_writer = None
+    if w is not None:
+        w.close()
+
+
+def insert_album_record(db, record):
+    """Inserts an album record in the open insert session of db"""
+
+    db.insert_album(record['sha1'], record['title'], record['dr'],
+                    disk_nr=record['disk_nr'], artist=record['artist'])
+
+    for t in record['tracks']:
+        db.insert_track(t['sha1'], t['title'],
+                        t['dr'], t['rms'], t['peak'], t['duration'],
+                        t['codec'], t['bit'], t['bitrate'], t['sampling_rate'],
+                        record['sha1'], t['artist'],
+                        t['genre'], t['date'], t['track_nr'], t['size'])
+
+
+def write_records(records):
+    """Writes the records in one transaction, nothing is written if one of them fails"""
+
+    db = dr_database_singletone().get()
+    db.open_insert_session()
+    try:
+        for record in records:
+            insert_album_record(db, record)
+    except:
+        db.abort_insert_session()
+        raise
+    db.commit_insert_session()
+
+
+class DatabaseWriter(threading.Thread):
+
+    def __init__(self, max_queue=DB_WRITER_QUEUE_SIZE, batch=DB_WRITER_BATCH, interval=DB_WRITER_INTERVAL):
+        super().__init__(name="dr14-db-writer", daemon=True)
+        self.queue = queue.Queue(max_queue)
+        self.batch = batch
+        self.interval = interval
+        self.written = 0
+        self.failed = 0
+
+    def submit(self, record):
+        self.queue.put(record)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        records = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = False
+
+            if record is None:
+                self.flush(records)
+                return
+
+            if record:
+                records.append(record)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+
+            if len(records) >= self.batch or (deadline is not None and time.monotonic() >= deadline):
+                self.flush(records)
+                records = []
+                deadline = None
+
+    def flush(self, records):
+        if len(records) == 0:
+            return
+
+        with profile_stage('db'):
+            try:
+                write_records(records)
+                self.written = self.written + len(records)
+                return
+            except:
+                if len(records) == 1:
+                    self.report_failure(records[0])
+                    return
+
+            # a failed batch is written again one album at a time, only the bad albums are lost
+            for record in records:
+                try:
+                    write_records([record])
+                    self.written = self.written + 1
+                except:
+                    self.report_failure(record)
+
+    def report_failure(self, record):
+        self.failed = self.failed + 1
+        print_msg(f"Local database: unable to write the album {record['title']}: {sys.exc_info()[1]}")
@@ -0,0 +1,223 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Scan with separate decode and compute stages (--pipeline).
+#
+# The ffmpeg processes are run by an asyncio loop, at most `decoders` files are decoded
+# at a time. The chunks of a track go through a bounded queue to a pool of `compute`
+# threads: when the computation is late the queue is full, the stdout of ffmpeg is no
+# longer read and ffmpeg waits. The files read by another decoder (decoders.py) are
+# analysed entirely in the compute pool.
+
+import asyncio
+import concurrent.futures
+import sys
+import time
+
+import numpy
+
+from dr14meter.audio_file_reader import read_wav_header_async, pcm_to_float
+from dr14meter.audio_track import AudioTrack, StructDuration
+from dr14meter.compute_dr14 import TrackAnalyzer
+from dr14meter.decoders import get_decoder, decoder_names, sniff_codec
+from dr14meter.dynamic_range_meter import run_mp, cached_result, file_result, file_size
+from dr14meter.profiler import profile_stage, profile_file, profile_time
+from dr14meter.result_cache import get_result_cache
+from dr14meter.scan_plan import get_scan_plan
+from dr14meter.out_messages import print_msg
+
+
+# chunks of a track waiting for the compute pool, a chunk is 6 s of audio
+DECODE_QUEUE_CHUNKS = 4
+# buffer of the asyncio reader of the ffmpeg stdout
+DECODE_PIPE_LIMIT = 1 << 20
+
+
+def run_pipeline(job_queue, on_result=None, decoders=2, compute=1, queue_chunks=DECODE_QUEUE_CHUNKS):
+    """Analyses the files, returns the results in the order of job_queue.
+
+    job_queue can be a generator, as a walk of the directories: it is iterated in a thread of
+    its own and a file starts as soon as it is yielded. on_result(i, res) is called as soon as
+    the file i is done, one file at a time in a thread of its own: it can write the reports of
+    an album while the files of the next ones are decoded.
+    """
+    pipeline = DecodePipeline(decoders, compute, queue_chunks)
+    return asyncio.run(pipeline.run(job_queue, on_result))
+
+
+class DecodePipeline:
+
+    def __init__(self, decoders, compute, queue_chunks=DECODE_QUEUE_CHUNKS):
+        self.decoders = max(1, decoders)
+        self.compute = max(1, compute)
+        self.queue_chunks = max(1, queue_chunks)
+        self.reader = get_decoder('ffmpeg')
+
+    async def run(self, job_queue, on_result=None):
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.decoders)
+
+        results = []
+        jobs = []
+
+        async def job(i, full_file):
+            results[i] = await self.analyse(full_file)
+            if on_result is not None:
+                # not in the loop, that would stop reading the pipes of the decoders
+                await self.loop.run_in_executor(self.consumer, on_result, i, results[i])
+
+        def start(full_file):
+            results.append(None)
+            jobs.append(asyncio.ensure_future(job(len(results) - 1, full_file)))
+
+        def feed():
+            # the files start in the order of the queue
+            for full_file in job_queue:
+                self.loop.call_soon_threadsafe(start, full_file)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.compute) as self.executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as self.consumer:
+            try:
+                await self.loop.run_in_executor(None, feed)
+            finally:
+                # the callbacks of feed run before the end of run_in_executor
+                await asyncio.gather(*jobs)
+
+        return results
+
+    async def analyse(self, full_file):
+        async with self.slots:
+            try:
+                if decoder_names(sniff_codec(full_file))[0] != 'ffmpeg':
+                    # decoded without ffmpeg, the whole analysis runs in the compute pool
+                    return await self.loop.run_in_executor(self.executor, run_mp, full_file)
+                return await self.analyse_ffmpeg(full_file)
+            except Exception:
+                print_msg(f"- fail - {full_file}: {sys.exc_info()[1]}")
+                return {'file_name': full_file.name, 'fail': True}
+
+    async def analyse_ffmpeg(self, full_file):
+        cache = get_result_cache()
+
+        res = cached_result(cache, full_file)
+        if res is not None:
+            return res
+
+        duration = StructDuration()
+
+        try:
+            res = await self.decode(full_file, duration)
+        except Exception:
+            print_msg(f"Unexpected error: {sys.exc_info()}")
+            res = None
+
+        # the result is written in the cache by the pool, not by the thread of the loop
+        return await self.loop.run_in_executor(self.executor, file_result, cache, full_file, res, duration)
+
+    async def decode(self, full_file, duration):
+        """(dr14, peak, rms, sha1) of a file decoded by ffmpeg"""
+
+        t = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            self.reader.get_cmd(), *self.reader.get_pipe_cmd_options(full_file),
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            limit=DECODE_PIPE_LIMIT)
+
+        try:
+            channels, Fs, sample_width = await read_wav_header_async(proc.stdout)
+            profile_time('decode', full_file, time.perf_counter() - t, file_size(full_file))
+
+            an = TrackAnalyzer(Fs, channels, AudioTrack.FORMATS.index(full_file.suffix.lower()),
+                               get_scan_plan().fingerprint)
+
+            chunks = asyncio.Queue(self.queue_chunks)
+            computed = asyncio.ensure_future(self.compute_chunks(full_file, an, chunks, channels, sample_width,
+                                                                 duration))
+
+            error = None
+            try:
+                # chunks aligned to the 3s blocks, as in analyse_stream
+                await self.read_chunks(full_file, proc.stdout, chunks, 2 * an.block_samples * channels * sample_width,
+                                       channels * sample_width)
+            except Exception:
+                error = sys.exc_info()[1]
+
+            await chunks.put(None)
+            res = await computed
+
+            if error is not None:
+                raise error
+            if await proc.wait() != 0:
+                raise RuntimeError(f"{self.reader.get_cmd()} exited with code {proc.returncode}")
+
+            return res
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    async def read_chunks(self, full_file, stream, chunks, chunk_bytes, frame_bytes):
+        while True:
+            t = time.perf_counter()
+            data = await read_chunk(stream, chunk_bytes)
+            profile_time('decode', full_file, time.perf_counter() - t)
+
+            data = data[:len(data) - len(data) % frame_bytes]
+            if not data:
+                return
+
+            # waits while the queue is full
+            await chunks.put(data)
+
+    async def compute_chunks(self, full_file, an, chunks, channels, sample_width, duration):
+        """Pushes the chunks of the queue to the analyzer until None, one at a time in the compute pool"""
+
+        error = None
+        while True:
+            data = await chunks.get()
+            if data is None:
+                break
+            # after an error the queue is still emptied, so that the decoder does not wait for ever
+            if error is None:
+                try:
+                    await self.loop.run_in_executor(self.executor, compute_chunk, full_file, an, data,
+                                                    channels, sample_width)
+                except Exception:
+                    error = sys.exc_info()[1]
+
+        if error is not None:
+            raise error
+
+        return await self.loop.run_in_executor(self.executor, compute_finish, full_file, an, duration)
+
+
+async def read_chunk(stream, size):
+    """size bytes of the stream, less at its end"""
+    try:
+        return await stream.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+
+
+def compute_chunk(full_file, an, data, channels, sample_width):
+    with profile_file(full_file), profile_stage('compute'):
+        X = numpy.frombuffer(data, dtype=f"int{sample_width * 8}").reshape(-1, channels)
+        an.push(pcm_to_float(X, sample_width))
+
+
+def compute_finish(full_file, an, duration):
+    with profile_file(full_file), profile_stage('compute'):
+        return an.finish(duration)
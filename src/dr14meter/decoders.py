@@ -0,0 +1,207 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Decoder backends of the audio files.
+#
+# The codec of a file is read from its first bytes (from its extension when they are not
+# known). The decoders of the codec are tried in order, ffmpeg is always the last one:
+# the decoder chosen by --bench-decoders, then those of DEFAULT_DECODERS. A decoder is
+# shared by all the files.
+
+import hashlib
+import pathlib
+import threading
+import time
+
+from dr14meter.audio_file_reader import AudioFileReader, WavFileReader, SoundfileReader
+from dr14meter.dr14_config import get_decoder_backend, set_decoder_backend
+from dr14meter.out_messages import print_msg, print_out
+
+
+# name: (reader class, the codecs it decodes or None for all)
+DECODER_BACKENDS = {
+    'wav': (WavFileReader, ['wav']),
+    # lossy codecs are left to ffmpeg: another decoder gives other samples, and another sha1
+    'soundfile': (SoundfileReader, ['flac']),
+    'ffmpeg': (AudioFileReader, None),
+}
+
+# the decoders tried before ffmpeg
+DEFAULT_DECODERS = {
+    'wav': ['wav'],
+    'flac': ['soundfile'],
+}
+
+# files of each codec decoded by --bench-decoders
+BENCH_FILES = 5
+
+decoders = {}
+lock_decoders = threading.Lock()
+
+
+def register_decoder(name, reader_class, codecs=None):
+    DECODER_BACKENDS[name] = (reader_class, codecs)
+
+
+def get_decoder(name):
+    """The reader of the backend, None if it is not available"""
+
+    with lock_decoders:
+        if name not in decoders:
+            reader_class, _ = DECODER_BACKENDS[name]
+            decoders[name] = reader_class() if reader_class.available() else None
+        return decoders[name]
+
+
+def sniff_codec(file_name):
+    try:
+        with open(file_name, 'rb') as f:
+            head = f.read(4)
+    except OSError:
+        head = b''
+
+    if head == b'fLaC':
+        return 'flac'
+    if head in (b'RIFF', b'RF64', b'riff'):
+        return 'wav'
+    if head == b'OggS':
+        return 'ogg'
+    return pathlib.Path(file_name).suffix.lower().lstrip('.')
+
+
+def reference_decoder(codec):
+    """The decoder of the samples the DR and the sha1 of the tracks have always been computed on"""
+    return 'wav' if codec == 'wav' else 'ffmpeg'
+
+
+def can_decode(name, codec):
+    codecs = DECODER_BACKENDS[name][1]
+    return codecs is None or codec in codecs
+
+
+def decoder_names(codec):
+    """The available decoders of the codec, in the order they are tried"""
+
+    names = []
+    chosen = get_decoder_backend(codec)
+
+    for name in ([chosen] if chosen else []) + DEFAULT_DECODERS.get(codec, []) + ['ffmpeg']:
+        if name in DECODER_BACKENDS and name not in names and can_decode(name, codec) \
+                and get_decoder(name) is not None:
+            names.append(name)
+
+    return names
+
+
+def get_decoders(file_name):
+    """The readers of the file, the first one that opens it is used"""
+    return [get_decoder(name) for name in decoder_names(sniff_codec(file_name))]
+
+
+def decode_digest(readers, files):
+    """The sha1 of the samples of the files, each one opened by the first reader able to; None if a file
+    cannot be decoded"""
+
+    sha = hashlib.sha1()
+
+    for file_name in files:
+        stream = None
+        for reader in readers:
+            stream = reader.open_audio_stream(file_name)
+            if stream is not None:
+                break
+        if stream is None:
+            return None
+        try:
+            for y in stream.read_chunks():
+                sha.update(y)
+        except:
+            return None
+        finally:
+            stream.close()
+
+    return sha.hexdigest()
+
+
+def bench_decoders(path_name, recursive=False, max_files=BENCH_FILES):
+    """Times the decoders on the audio files of path_name, the fastest one of each codec is written in the
+    configuration. A decoder is timed with the reference decoder as fallback, as in a scan, and it is not
+    chosen if its samples are not those of the reference decoder."""
+
+    from dr14meter.audio_track import AudioTrack
+
+    path_name = pathlib.Path(path_name)
+    files_list = path_name.rglob('*') if recursive else path_name.glob('*')
+
+    codec_files = {}
+    for f in sorted(files_list):
+        if f.suffix.lower() in AudioTrack.FORMATS and f.is_file():
+            files = codec_files.setdefault(sniff_codec(f), [])
+            if len(files) < max_files:
+                files.append(f)
+
+    if len(codec_files) == 0:
+        print_msg(f"No audio files found in {path_name}")
+        return False
+
+    print_out(f"{'codec':8s} {'decoder':10s} {'files':>5s} {'time [s]':>9s}")
+
+    for codec, files in sorted(codec_files.items()):
+        # the files are read once, so that the first decoder does not pay for the disk
+        for f in files:
+            f.read_bytes()
+
+        reference = reference_decoder(codec)
+        names = [reference] + [n for n in DECODER_BACKENDS if n != reference and can_decode(n, codec)]
+
+        times = {}
+        ref_digest = None
+
+        for name in names:
+            reader = get_decoder(name)
+            if reader is None:
+                print_out(f"{codec:8s} {name:10s} {len(files):5d}     not available")
+                continue
+
+            readers = [reader] if name == reference else [reader, get_decoder(reference)]
+
+            t = time.perf_counter()
+            digest = decode_digest(readers, files)
+            t = time.perf_counter() - t
+
+            if digest is None:
+                print_out(f"{codec:8s} {name:10s} {len(files):5d}     unable to decode the files")
+                if name == reference:
+                    break
+                continue
+
+            if name == reference:
+                ref_digest = digest
+            elif digest != ref_digest:
+                print_out(f"{codec:8s} {name:10s} {len(files):5d} {t:9.3f} other samples than {reference}, not used")
+                continue
+
+            print_out(f"{codec:8s} {name:10s} {len(files):5d} {t:9.3f}")
+            times[name] = t
+
+        if len(times) > 0:
+            best = min(times, key=times.get)
+            set_decoder_backend(codec, best)
+            print_msg(f"- {codec}: {best}")
+        else:
+            print_msg(f"- {codec}: no decoder can be checked against {reference}")
+
+    return True
@@ -0,0 +1,89 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Walk of the directories to scan.
+#
+# Each directory is read once by os.scandir: its audio files, its dr14*.txt reports (for
+# --skip) and its subdirectories come from the same listing, the type of an entry is
+# usually known without a stat. The albums are yielded while the walk goes on, so that
+# the first tracks are decoded before the last directory has been read.
+
+import os
+import pathlib
+
+from dr14meter.audio_track import AudioTrack
+from dr14meter.profiler import profile_stage
+
+
+class AlbumDir:
+    """A directory of the walk: its audio files and the names of its dr14*.txt reports, sorted"""
+
+    def __init__(self, path, files, reports):
+        self.path = path
+        self.files = files
+        self.reports = reports
+
+
+def walk_albums(path_name, recursive=False):
+    """Yields the AlbumDir of path_name then, with recursive, those of its subdirectories (depth first, by name).
+
+    As rglob, the symbolic links to a directory are scanned but not walked. The directories that cannot be
+    read are left out.
+    """
+
+    stack = [(pathlib.Path(path_name), True)]
+
+    while stack:
+        path, walk = stack.pop()
+
+        with profile_stage('walk'):
+            album, subdirs = read_dir(path)
+
+        if album is None:
+            continue
+
+        if recursive and walk:
+            stack.extend(reversed(subdirs))
+
+        yield album
+
+
+def read_dir(path):
+    """(AlbumDir, [(subdirectory, not a link)]) of the directory, (None, []) if it cannot be read"""
+
+    files = []
+    reports = []
+    subdirs = []
+
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+
+                if is_dir:
+                    subdirs.append((path / entry.name, not entry.is_symlink()))
+                elif os.path.splitext(entry.name)[1] in AudioTrack.FORMATS:
+                    files.append(path / entry.name)
+                elif entry.name.startswith('dr14') and entry.name.endswith('.txt'):
+                    reports.append(entry.name)
+    except OSError:
+        return None, []
+
+    subdirs.sort()
+    return AlbumDir(path, sorted(files), sorted(reports)), subdirs
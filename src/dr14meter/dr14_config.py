@@ -21,10 +21,16 @@
 import os.path
 import os
 import sys
+import threading
 
 import configparser as ConfigParser
 
 
+# the configuration of the process, see get_config
+dr14_cfg = None
+lock_cfg = threading.Lock()
+
+
 def get_config_directory(create=True):
 
     p = os.environ.get('XDG_CONFIG_HOME')
@@ -35,13 +41,13 @@ def get_config_directory(create=True):
     cfg_dir = os.path.join(p, 'dr14meter')
 
     if not os.path.isdir(cfg_dir) and create:
-        os.mkdir(cfg_dir)
+        os.makedirs(cfg_dir)
 
     return cfg_dir
 
 
 def get_config_file(create=True):
-    cfg_dir = get_config_directory()
+    cfg_dir = get_config_directory(create)
     cfg_file = "%s/%s" % (cfg_dir, "dr14.cfg")
 
     if not os.path.isfile(cfg_file) and create:
@@ -50,7 +56,7 @@ def get_config_file(create=True):
     return cfg_file
 
 
-def write_default_cfg(cfg_file):
+def default_cfg():
     config = ConfigParser.ConfigParser()
 
     config.add_section('config_version')
@@ -59,11 +65,85 @@ def write_default_cfg(cfg_file):
     config.add_section('database')
 
     config.set('database', 'enabled', 'False')
-    config.set('database', 'path', get_config_directory() + "/dr14.db")
+    config.set('database', 'path', get_config_directory(create=False) + "/dr14.db")
     config.set('database', 'collection_dir', '/')
 
-    with open(cfg_file, 'w') as configfile:
-        config.write(configfile)
+    # codec = decoder, written by --bench-decoders
+    config.add_section('decoders')
+
+    return config
+
+
+def write_default_cfg(cfg_file):
+    write_cfg(cfg_file, default_cfg())
+
+
+def write_cfg(cfg_file, config):
+    """Writes the file atomically: a reader sees the old or the new file, never a partial one"""
+
+    tmp_file = f"{cfg_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'wt') as configfile:
+            config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+        os.replace(tmp_file, cfg_file)
+    except:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def file_stamp(file_name):
+    try:
+        st = os.stat(file_name)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def get_config():
+    global dr14_cfg
+    with lock_cfg:
+        if dr14_cfg is None:
+            dr14_cfg = Dr14Config()
+        return dr14_cfg
+
+
+class Dr14Config:
+    """The configuration file parsed once, and again when its mtime or size change"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.config = None
+        self.stamp = None
+
+    def parser(self):
+        # the file name follows XDG_CONFIG_HOME, it can change between two calls
+        cfg_file = get_config_file(create=False)
+        stamp = (cfg_file, file_stamp(cfg_file))
+
+        with self.lock:
+            if self.config is None or stamp != self.stamp:
+                config = default_cfg()
+                config.read(cfg_file)
+                self.config = config
+                self.stamp = stamp
+            # the parser is replaced, never modified: it can be read without the lock
+            return self.config
+
+    def get(self, section, field):
+        return self.parser().get(section, field)
+
+    def set(self, section, field, value):
+        with self.lock:
+            cfg_file = get_config_file()
+            config = default_cfg()
+            config.read(cfg_file)
+            config.set(section, field, value)
+            write_cfg(cfg_file, config)
+            self.config = config
+            self.stamp = (cfg_file, file_stamp(cfg_file))
 
 
 def set_db_path(full_file_path):
@@ -87,12 +167,7 @@ def set_collection_dir(path):
 
 
 def set_config_field(section, field, value):
-    cfg_file = get_config_file()
-    config = ConfigParser.ConfigParser()
-    config.read(cfg_file)
-    config.set(section, field, value)
-    with open(cfg_file, 'wt') as configfile:
-        config.write(configfile)
+    get_config().set(section, field, value)
 
 
 def get_db_path():
@@ -108,8 +183,15 @@ def get_collection_dir():
     return get_config_filed('database', 'collection_dir')
 
 
+def get_decoder_backend(codec):
+    """The decoder chosen for the codec by --bench-decoders, None if there is none"""
+    return get_config().parser().get('decoders', codec, fallback=None)
+
+
+def set_decoder_backend(codec, name):
+    set_config_field('decoders', codec, name)
+
+
 def get_config_filed(section, field):
-    config = ConfigParser.ConfigParser()
-    cfg_file = get_config_file()
-    config.read(cfg_file)
-    return config.get(section, field)
+    # the config file is written by the first change of a field, reading it does not create it
+    return get_config().get(section, field)
@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import importlib.metadata
+import importlib
 import threading
 import shutil
 
@@ -27,11 +27,21 @@ from dr14meter.out_messages import print_msg
 lock_ver = threading.Lock()
 
 ffmpeg_cmd = None
+app_version = None
 
 
 def dr14_version():
+    global app_version
+
+    if app_version is not None:
+        return app_version
+
+    # importlib.metadata is slow to import, it is not needed at startup
+    import importlib.metadata
+
     try:
-        return importlib.metadata.version('dr14meter')
+        app_version = importlib.metadata.version('dr14meter')
+        return app_version
     except ModuleNotFoundError:
         print_msg("Unable to get the version of the app")
     return 'UNDEF'
@@ -23,22 +23,22 @@ import pathlib
 import subprocess
 import sys
 import logging
-import numpy
 
 from dr14meter.parse_args import parse_args
-from dr14meter.dynamic_range_meter import DynamicRangeMeter
 from dr14meter.dr14_global import get_exe_name, dr14_version
-from dr14meter.dr14_utils import  scan_dir_list, scan_files_list
 from dr14meter.out_messages import print_err, print_msg, print_out, set_quiet_msg, init_log
 from dr14meter.dr14_config import enable_db, db_is_enabled, database_exists
-from dr14meter.database.database import dr_database_singletone
-from dr14meter.database.database_utils import enable_database, query_helper, fix_problematic_database, database_exec_query
+from dr14meter.profiler import enable_profile
 from dr14meter import dr14_global
-from dr14meter import audio_analysis as aa
+
+# numpy, the analysis, the database and the plot modules are imported by the options
+# using them: -v or -q do not load numpy, a scan does not load the database utilities
 
 
 
 def run_analysis_opt(options, path_name):
+    from dr14meter import audio_analysis as aa
+
     flag = False
 
     if options.compress:
@@ -102,6 +102,14 @@ def run_analysis_opt(options, path_name):
 
 
 def parse_database_related(options):
+    if not (options.enable_database or options.disable_database or options.dump_database or
+            options.check_database or options.query is not None or db_is_enabled()):
+        return False
+
+    from dr14meter.database.database import dr_database_singletone
+    from dr14meter.database.database_utils import enable_database, query_helper, fix_problematic_database, \
+        database_exec_query, check_database
+
     if options.enable_database:
         enable_database()
         return True
@@ -125,6 +133,21 @@ def parse_database_related(options):
             fix_problematic_database()
             return True
 
+    # -q and --check_database read the tables of the migrations, a disabled database is upgraded as well
+    if db_is_enabled() or ((options.check_database or options.query is not None) and database_exists()):
+        db = dr_database_singletone().get()
+        try:
+            db.ungrade_db()
+        except:
+            print_err(f"the upgrade of the database has failed: {sys.exc_info()[1]}")
+
+    if options.check_database:
+        if not database_exists():
+            print_err("Error: The database does not exist")
+            return True
+        check_database()
+        return True
+
     if options.query is not None:
 
         if not database_exists():
@@ -138,7 +161,7 @@ def parse_database_related(options):
 
         if options.query[0] not in ["help", "top", "top_alb",
                                     "worst", "worst_alb", "top_art",
-                                    "hist", "evol", "codec"]:
+                                    "hist", "evol", "codec", "search"]:
 
             print_err("Error: -q invalid parameter .")
             print_err(f"Error: type {get_exe_name} -q for more info.")
@@ -163,8 +186,6 @@ def main():
     init_log(logging.DEBUG)
     logging.disable(logging.INFO)
 
-    numpy.seterr(all='ignore')
-
     #print( options )
 
     # everything related to the database functionality
@@ -189,9 +210,28 @@ def main():
         print_msg(f'Error (-o): The target directory "{options.out_dir}"  does not exist!')
         return
 
+    import numpy
+    from dr14meter.dynamic_range_meter import DynamicRangeMeter
+    from dr14meter.dr14_utils import scan_dir_list, scan_files_list, write_profile_opt
+    from dr14meter.dir_walker import walk_albums
+    from dr14meter.result_cache import set_cache_enabled
+    from dr14meter.database.writer import start_db_writer, stop_db_writer
+    from dr14meter.scan_plan import plan_scan, set_scan_plan
+
+    numpy.seterr(all='ignore')
+
+    # the stages not needed by the options are skipped
+    set_scan_plan(plan_scan(options, db_is_enabled()))
+
     if options.quiet:
         set_quiet_msg()
 
+    if options.no_cache:
+        set_cache_enabled(False)
+
+    if options.profile is not None:
+        enable_profile()
+
     # if not options.quiet and not options.skip_version_check:
     #     l_ver = TestVer()
     #     l_ver.start()
@@ -199,9 +239,10 @@ def main():
     print_msg(path_name)
     print_msg("")
 
-    subdirlist = [path_name]
-    if options.recursive:
-        subdirlist += [p for p in path_name.rglob('*') if p.is_dir()]
+    if options.bench_decoders:
+        from dr14meter.decoders import bench_decoders
+        bench_decoders(path_name, options.recursive)
+        return 0
 
     # utils options
     if run_analysis_opt(options, path_name):
@@ -228,10 +269,20 @@ def main():
     if options.append and out_dir is None:
         out_dir = path_name
 
-    if options.files_list:
-        success, clock, r = scan_files_list(path_name, options, out_dir)
-    else:
-        success, clock, r = scan_dir_list(subdirlist, options, out_dir)
+    if db_is_enabled():
+        start_db_writer()
+
+    try:
+        if options.files_list:
+            success, clock, r = scan_files_list(path_name, options, out_dir)
+        else:
+            # the directories are scanned while they are walked
+            success, clock, r = scan_dir_list(walk_albums(path_name, options.recursive), options, out_dir)
+    finally:
+        # the albums still queued for the local database are written
+        stop_db_writer()
+
+    write_profile_opt(options)
 
     if success:
         print_msg("Success!")
@@ -18,15 +18,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import multiprocessing
 import os
+import queue
+import sys
 import tempfile
+import threading
 import fileinput
 import time
 
 
 from dr14meter import dr14_config as config
-from dr14meter.dynamic_range_meter import DynamicRangeMeter #,
+from dr14meter.dynamic_range_meter import DynamicRangeMeter, get_executor, get_result, run_mp, file_size
+from dr14meter.profiler import profile_stage, write_profile
+from dr14meter.scan_plan import get_scan_plan
 from dr14meter.table import TextTable, BBcodeTable, HtmlTable, MediaWikiTable
 from dr14meter.out_messages import print_msg
 
@@ -47,8 +51,7 @@ def scan_files_list(input_file, options, out_dir):
     for line in fileinput.input(input_file):
         files_list.append(os.path.abspath(line.rstrip()))
 
-    dr = DynamicRangeMeter()
-    dr.write_to_local_db(config.db_is_enabled())
+    dr = new_dynamic_range_meter(options)
 
     cpu = 1 if options.disable_multithread else get_thread_cnt()
     r = dr.scan_mp(files_list=files_list, thread_cnt=cpu)
@@ -59,56 +62,208 @@ def scan_files_list(input_file, options, out_dir):
         success = True
         write_results(dr, options, out_dir, "")
 
-    if options.tag:
+    if get_scan_plan().tag:
         from dr14meter.tagger import Tagger
         tagger = Tagger()
         tagger.write_dr_tags(dr)
 
-
     clock = time.time() - a
     return success, clock, r
 
 
-def scan_dir_list(subdirlist, options, out_dir):
+def scan_dir_list(albums, options, out_dir):
+    """Scans the AlbumDir of the walk (dir_walker.py), as they come"""
+
     a = time.time()
 
+    cpu = 1 if options.disable_multithread else get_thread_cnt()
+
+    if cpu > 1:
+        success, r = scan_albums_mp(albums, options, out_dir, cpu)
+        return success, time.time() - a, r
+
     success = False
     r = 0
 
-    for cur_dir in subdirlist:
+    for album in albums:
         print_msg("\n------------------------------------------------------------ ")
-        if options.skip:
-            x = list(cur_dir.glob('dr14*.txt'))
-            if len(x) > 0:
-                print_msg(f'# Skipping "{cur_dir}", because {[a.name for a in x]} found.')
-                continue
-        dr = DynamicRangeMeter()
-        dr.write_to_local_db(config.db_is_enabled())
-
-        print_msg(f"> Scan Dir: {cur_dir} \n")
+        if skip_dir(album, options):
+            continue
+        dr = new_dynamic_range_meter(options)
 
-        cpu = 1 if options.disable_multithread else get_thread_cnt()
-        r = dr.scan_mp(cur_dir, cpu)
+        print_msg(f"> Scan Dir: {album.path} \n")
 
-        if options.tag:
-            from dr14meter.tagger import Tagger
-            tagger = Tagger()
-            tagger.write_dr_tags(dr)
+        r = dr.scan_mp(album.path, cpu, album.files)
 
-        if r < 1:
-            continue
-        else:
+        if write_album(dr, r, options, out_dir, album.path):
             success = True
 
-        write_results(dr, options, out_dir, cur_dir)
-
     clock = time.time() - a
 
     return success, clock, r
 
 
+class AlbumJob:
+    """The tracks of a directory scanned by scan_albums_mp"""
+
+    def __init__(self, cur_dir, dr, job_queue):
+        self.cur_dir = cur_dir
+        self.dr = dr
+        self.job_queue = job_queue
+        self.results = [None] * len(job_queue)
+        self.pending = len(job_queue)
+
+
+def scan_albums_mp(albums, options, out_dir, cpu):
+    """Scans the directories feeding the tracks of all the albums to a single pool.
+
+    The tracks of an album are submitted as soon as the walk yields it, the longest
+    ones (by file size) first; an album is written as soon as all its tracks are done.
+    """
+
+    success = False
+    r = 0
+
+    # with the pipeline the walk and the results run in threads of their own
+    lock_albums = threading.Lock()
+
+    def finish(album):
+        nonlocal success, r
+        with lock_albums:
+            r = finish_album(album, options, out_dir)
+            success = success or r > 0
+
+    def track_done(album, i, res):
+        album.results[i] = res
+        album.pending = album.pending - 1
+
+        if album.pending == 0:
+            finish(album)
+
+    def album_tracks():
+        """(album, i) of the tracks, in the order of the walk"""
+
+        for album_dir in albums:
+            if skip_dir(album_dir, options):
+                continue
+            dr = new_dynamic_range_meter(options)
+            job_queue = dr.get_job_queue(album_dir.path, album_dir.files)
+            dr.meta_data.start_probe(job_queue)
+            album = AlbumJob(album_dir.path, dr, job_queue)
+
+            if album.pending == 0:
+                finish(album)
+                continue
+
+            for i in sorted(range(len(job_queue)), key=lambda k: file_size(job_queue[k]), reverse=True):
+                yield album, i
+
+    sizes = get_pipeline_sizes(options, cpu)
+
+    if sizes is not None:
+        from dr14meter.decode_pipeline import run_pipeline
+        decoders, compute = sizes
+        tracks = []
+
+        def files():
+            for album, i in album_tracks():
+                tracks.append((album, i))
+                yield album.job_queue[i]
+
+        run_pipeline(files(), lambda k, res: track_done(*tracks[k], res), decoders=decoders, compute=compute)
+        return success, r
+
+    # the futures done, the albums are written by this thread
+    done = queue.SimpleQueue()
+    pending = 0
+
+    def collect():
+        future, album, i = done.get()
+        track_done(album, i, get_result(future, album.job_queue[i]))
+
+    with get_executor(cpu, options.process_pool) as executor:
+        for album, i in album_tracks():
+            full_file = album.job_queue[i]
+            try:
+                future = executor.submit(run_mp, full_file)
+            except Exception:
+                # the process pool has been shut down after the death of a worker
+                print_msg(f"- fail - {full_file}: {sys.exc_info()[1]}")
+                track_done(album, i, {'file_name': full_file.name, 'fail': True})
+                continue
+
+            future.add_done_callback(lambda f, album=album, i=i: done.put((f, album, i)))
+            pending = pending + 1
+
+            # the albums already done are written while the walk goes on
+            while not done.empty():
+                collect()
+                pending = pending - 1
+
+        while pending > 0:
+            collect()
+            pending = pending - 1
+
+    return success, r
+
+
+def finish_album(album, options, out_dir):
+    print_msg("\n------------------------------------------------------------ ")
+    print_msg(f"> Scan Dir: {album.cur_dir} \n")
+
+    r = album.dr.set_results(album.job_queue, album.results)
+    write_album(album.dr, r, options, out_dir, album.cur_dir)
+
+    return r
+
+
+def skip_dir(album, options):
+    if options.skip and len(album.reports) > 0:
+        print_msg(f'# Skipping "{album.path}", because {album.reports} found.')
+        return True
+    return False
+
+
+def new_dynamic_range_meter(options):
+    dr = DynamicRangeMeter()
+    dr.write_to_local_db(config.db_is_enabled())
+    dr.use_process_pool(options.process_pool)
+    cpu = 1 if options.disable_multithread else get_thread_cnt()
+    dr.use_pipeline(get_pipeline_sizes(options, cpu))
+    return dr
+
+
+def write_album(dr, r, options, out_dir, cur_dir):
+    if get_scan_plan().tag:
+        from dr14meter.tagger import Tagger
+        tagger = Tagger()
+        tagger.write_dr_tags(dr)
+
+    if r < 1:
+        return False
+
+    write_results(dr, options, out_dir, cur_dir)
+    return True
+
+
+def write_profile_opt(options):
+    if options.profile is not None:
+        write_profile(options.profile)
+
+
+def get_pipeline_sizes(options, cpu):
+    """(decoders, compute threads) of --pipeline, None without it; --decoders and --compute_threads imply it"""
+
+    if not (options.pipeline or options.decoders or options.compute_threads):
+        return None
+
+    compute = options.compute_threads or cpu
+    decoders = options.decoders or 2 * compute
+    return decoders, compute
+
+
 def get_thread_cnt():
-    cpu = multiprocessing.cpu_count()
+    cpu = os.cpu_count() or 1
     cpu = max(2, int(round(cpu / 2)))
     return cpu
 
@@ -128,15 +283,18 @@ def write_results(dr, options, out_dir, cur_dir):
         print_msg("- The result files will be written in the tmp dir: %s " % full_out_dir)
         print_msg("--------------------------------------------------------------- ")
 
-    if options.print_std_out:
-        dr.fwrite_dr("", TextTable(), table_format, std_out=True)
+    plan = get_scan_plan()
 
-    if options.turn_off_out:
-        return
+    if plan.std_out:
+        with profile_stage('report'):
+            dr.fwrite_dr("", TextTable(), table_format, std_out=True)
+
+    if plan.db:
+        dr.write_to_local_database()
 
-    all_tables = False
-    if 'a' in options.out_tables:
-        all_tables = True
+    # none with -n
+    if len(plan.reports) == 0:
+        return
 
     tables_list = {
         'b': ["dr14_bbcode.txt", BBcodeTable()],
@@ -147,13 +305,11 @@ def write_results(dr, options, out_dir, cur_dir):
 
     out_list = ""
 
-    dr.write_to_local_database()
-
-    for code in tables_list.keys():
-        if code in options.out_tables or all_tables:
+    for code in plan.reports:
+        with profile_stage('report'):
             dr.fwrite_dr(os.path.join(full_out_dir, tables_list[code][0]), tables_list[code][1], table_format,
                          append=options.append, dr_database=options.dr_database)
-            out_list += " %s " % tables_list[code][0]
+        out_list += " %s " % tables_list[code][0]
 
     print_msg("")
     print_msg("- The full result has been written in the files: %s" % out_list)
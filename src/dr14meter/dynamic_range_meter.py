@@ -17,18 +17,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import concurrent.futures
+import contextlib
 import os
 import pathlib
 import sys
+import threading
 
-from dr14meter.compute_dr14 import compute_dr14
+import numpy
+
+from dr14meter.compute_dr14 import TrackAnalyzer
 from dr14meter.audio_track import AudioTrack, StructDuration
 from dr14meter.read_metadata import RetrieveMetadata
 from dr14meter.write_dr import WriteDr, WriteDrExtended
-from dr14meter.audio_math import sha1_track_v1
+from dr14meter.database.writer import get_db_writer
 from dr14meter.dr14_config import get_collection_dir
 from dr14meter.dr14_global import min_dr
-from dr14meter.out_messages import print_msg, print_out, flush_msg
+from dr14meter.profiler import profile_stage, profile_file, profile_bytes, enable_profile, is_profile_enabled, \
+    worker_file_profile, merge_file_profile
+from dr14meter.result_cache import get_result_cache, set_cache_enabled, is_cache_enabled
+from dr14meter.scan_plan import get_scan_plan, set_scan_plan
+from dr14meter.out_messages import print_msg, print_out, flush_msg, set_quiet_msg, is_quiet_msg
+
+
+process_pool = None
+process_pool_workers = 0
+lock_pool = threading.Lock()
 
 
 class DynamicRangeMeter:
@@ -39,11 +52,20 @@ class DynamicRangeMeter:
         self.dr14 = 0
         self.meta_data = RetrieveMetadata()
         self.__write_to_local_db = False
+        self.__use_process_pool = False
+        self.__pipeline = None
         self.coll_dir = os.path.realpath(get_collection_dir())
 
     def write_to_local_db(self, f=False):
         self.__write_to_local_db = f
 
+    def use_process_pool(self, f=False):
+        self.__use_process_pool = f
+
+    def use_pipeline(self, sizes=None):
+        """sizes is (decoders, compute threads) of the decode pipeline, None for the pool of run_mp"""
+        self.__pipeline = sizes
+
     def scan_file(self, file_name):
         file_name = pathlib.Path(file_name)
         res = run_mp(file_name)
@@ -57,7 +79,14 @@ class DynamicRangeMeter:
         wr = WriteDr()
 
         if self.__write_to_local_db and os.path.realpath(self.dir_name).startswith(self.coll_dir):
-            wr.write_to_local_dr_database(self)
+            writer = get_db_writer()
+            if writer is None:
+                with profile_stage('db'):
+                    wr.write_to_local_dr_database(self)
+            else:
+                # the insert is timed by the writer thread, here the record and the wait of a full queue
+                with profile_stage('db_queue'):
+                    writer.submit(wr.album_record(self))
 
     def fwrite_dr(self, file_name, tm, ext_table=False, std_out=False, append=False, dr_database=True):
 
@@ -84,26 +113,53 @@ class DynamicRangeMeter:
 
     def scan_mp(self, dir_name=None, thread_cnt=None, files_list=None):
 
-        self.dr14 = 0
+        job_queue = self.get_job_queue(dir_name, files_list)
+        if job_queue is None:
+            return -1
+
+        # the metadata are read while the files are decoded
+        self.meta_data.start_probe(job_queue)
+
+        if self.__pipeline is not None:
+            from dr14meter.decode_pipeline import run_pipeline
+            decoders, compute = self.__pipeline
+            results = run_pipeline(job_queue, decoders=decoders, compute=compute)
+        elif thread_cnt > 1:
+            with get_executor(thread_cnt, self.__use_process_pool) as executor:
+                results = collect_results([executor.submit(run_mp, x) for x in job_queue], job_queue)
+        else:
+            results = [run_mp(x) for x in job_queue]
 
-        if not files_list:
+        return self.set_results(job_queue, results)
+
+    def get_job_queue(self, dir_name=None, files_list=None):
+        """The audio files of the directory or of the list, None if dir_name is not a directory.
+
+        With both, files_list holds the files of the directory, as read by the walk (dir_walker.py).
+        """
+
+        with profile_stage('walk'):
+            return self.__get_job_queue(dir_name, files_list)
+
+    def __get_job_queue(self, dir_name, files_list):
+
+        if files_list is None:
             dir_name = pathlib.Path(dir_name)
             if not dir_name.is_dir():
-                return -1
-            files_list = sorted(dir_name.glob('*'))
+                return None
+            files_list = dir_name.glob('*')
+
+        if dir_name is not None:
             self.dir_name = str(dir_name)
-        else:
-            files_list = sorted(pathlib.Path(x) for x in files_list)
 
-        job_queue = [x for x in files_list if x.suffix in AudioTrack.FORMATS]
+        files_list = sorted(pathlib.Path(x) for x in files_list)
 
-        if thread_cnt > 1:
-            # #6 DR14 Report File Missing Tracks That Appear in Console Output
-            # with concurrent.futures.ProcessPoolExecutor(max_workers=thread_cnt) as executor:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=thread_cnt) as executor:
-                results = list(executor.map(run_mp, job_queue))
-        else:
-            results = [run_mp(x) for x in job_queue]
+        return [x for x in files_list if x.suffix in AudioTrack.FORMATS]
+
+    def set_results(self, job_queue, results):
+        """Collects the results of the files in job_queue, returns the number of valid tracks."""
+
+        self.dr14 = 0
 
         # #6 DR14 Report File Missing Tracks That Appear in Console Output
         if len(results) != len(job_queue):
@@ -126,20 +182,156 @@ class DynamicRangeMeter:
         else:
             return 0
 
+
+def get_executor(thread_cnt, use_process_pool=False):
+    """An executor to be used in a with statement; the process pool is shared and stays alive."""
+    if use_process_pool:
+        return contextlib.nullcontext(get_process_pool(thread_cnt))
+    return concurrent.futures.ThreadPoolExecutor(max_workers=thread_cnt)
+
+
+def collect_results(futures, job_queue):
+    """The results of the jobs in the order of the queue, a failed job gives a 'fail' result.
+
+    #6 DR14 Report File Missing Tracks That Appear in Console Output:
+    an exception in a worker must not drop the results of the other files.
+    """
+
+    return [get_result(future, full_file) for future, full_file in zip(futures, job_queue)]
+
+
+def get_result(future, full_file):
+    try:
+        res = future.result()
+        merge_file_profile(full_file, res.pop('profile', None))
+        return res
+    except concurrent.futures.BrokenExecutor:
+        # BrokenProcessPool, concurrent.futures.process is not imported without the process pool
+        print_msg(f"- fail - {full_file}: the worker process died")
+        shutdown_process_pool()
+    except Exception:
+        print_msg(f"- fail - {full_file}: {sys.exc_info()[1]}")
+
+    return {'file_name': full_file.name, 'fail': True}
+
+
+def get_mp_context():
+    import multiprocessing
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        # the workers are forked from a server that has already imported the analysis code
+        ctx.set_forkserver_preload(['numpy', 'dr14meter.dynamic_range_meter'])
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+def init_worker(quiet, cache, profile, plan):
+    numpy.seterr(all='ignore')
+    set_scan_plan(plan)
+    if quiet:
+        set_quiet_msg()
+    set_cache_enabled(cache)
+    if profile:
+        enable_profile(worker=True)
+
+
+def get_process_pool(workers):
+    """The process pool is created once and reused by all the scans with the same number of workers."""
+
+    global process_pool
+    global process_pool_workers
+
+    with lock_pool:
+        if process_pool is None or process_pool_workers != workers:
+            if process_pool is not None:
+                process_pool.shutdown()
+            process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_mp_context(),
+                initializer=init_worker,
+                initargs=(is_quiet_msg(), is_cache_enabled(), is_profile_enabled(), get_scan_plan()))
+            process_pool_workers = workers
+
+        return process_pool
+
+
+def shutdown_process_pool():
+    global process_pool
+
+    with lock_pool:
+        if process_pool is not None:
+            process_pool.shutdown(wait=False)
+            process_pool = None
+
+
 def run_mp(full_file: pathlib.Path, at=None):
 
+    with profile_file(full_file):
+        res = analyse_file(full_file, at)
+
+    file_profile = worker_file_profile(full_file)
+    if file_profile is not None:
+        res['profile'] = file_profile
+
+    return res
+
+
+def analyse_file(full_file, at=None):
+
+    cache = get_result_cache()
+
+    res = cached_result(cache, full_file)
+    if res is not None:
+        return res
+
     if not at:
         at = AudioTrack()
     duration = StructDuration()
 
-    if at.open(full_file):
-        dr14, dB_peak, dB_rms = compute_dr14(at.Y, at.Fs, duration)
-        sha1 = sha1_track_v1(at.Y, at.get_file_ext_code())
+    res = None
+
+    with profile_stage('decode'):
+        opened = at.open_stream(full_file)
+
+    if opened:
+        profile_bytes('decode', file_size(full_file))
+        try:
+            res = analyse_stream(at, duration)
+        except:
+            print_msg(f"Unexpected error: {sys.exc_info()}")
+        finally:
+            at.close()
+
+    return file_result(cache, full_file, res, duration)
+
+
+def cached_result(cache, full_file):
+    """The result of a previous scan of the file, None if it is not in the cache"""
+
+    if cache is None:
+        return None
+
+    res = cache.get_result(full_file)
+    if res is not None and res.get('sha1') is None and get_scan_plan().fingerprint:
+        # scanned without fingerprint
+        return None
+    if res is not None:
+        print_msg(full_file.name + ": \t DR " + str(int(res['dr14'])) + " (cached)")
+        flush_msg()
+        res['file_name'] = full_file.name
+    return res
+
+
+def file_result(cache, full_file, res, duration):
+    """The result dict of the file, res is the (dr14, peak, rms, sha1) of the analysis or None if it failed"""
+
+    if res is not None:
+        dr14, dB_peak, dB_rms, sha1 = res
 
         print_msg(full_file.name + ": \t DR " + str(int(dr14)))
         flush_msg()
 
-        return {
+        res = {
             'file_name': full_file.name,
             'dr14': dr14,
             'dB_peak': dB_peak,
@@ -148,6 +340,11 @@ def run_mp(full_file: pathlib.Path, at=None):
             'sha1': sha1,
             'fail': False,
         }
+
+        if cache is not None:
+            cache.put_result(full_file, res)
+
+        return res
     else:
         print_msg(f"- fail - {full_file}")
         return {
@@ -156,3 +353,29 @@ def run_mp(full_file: pathlib.Path, at=None):
         }
 
 
+def analyse_stream(at, duration):
+    """Compute DR14, peak, rms and sha1 of an opened AudioTrack stream, chunk by chunk; the sha1 is None when the
+    plan has no fingerprint."""
+
+    an = TrackAnalyzer(at.Fs, at.channels, at.get_file_ext_code(), get_scan_plan().fingerprint)
+
+    # chunks aligned to the 3s blocks, so that they are not copied
+    chunks = at.read_chunks(2 * an.block_samples)
+
+    while True:
+        with profile_stage('decode'):
+            y = next(chunks, None)
+        if y is None:
+            break
+        with profile_stage('compute'):
+            an.push(y)
+
+    with profile_stage('compute'):
+        return an.finish(duration)
+
+
+def file_size(file_name):
+    try:
+        return file_name.stat().st_size
+    except OSError:
+        return 0
@@ -20,7 +20,6 @@
 import sys
 import os
 import logging
-import codecs
 
 message_file = sys.stderr
 out_file = sys.stdout
@@ -92,9 +91,10 @@ def set_verbose_msg():
     if mode == "verbose":
         return
 
-    codecs.close(message_file)
+    message_file.close()
 
     message_file = sys.stderr
+    mode = "verbose"
 
 
 def set_quiet_msg():
@@ -105,3 +105,8 @@ def set_quiet_msg():
         return
 
     message_file = open(os.devnull, "w")
+    mode = "quiet"
+
+
+def is_quiet_msg():
+    return mode == "quiet"
@@ -33,6 +33,43 @@ def parse_args():
                         dest="disable_multithread",
                         help="Disable the multi-Core mode")
 
+    parser.add_argument("--process_pool",
+                        action="store_true",
+                        dest="process_pool",
+                        help="Analyse the files in worker processes instead of threads")
+
+    parser.add_argument("--bench-decoders",
+                        action="store_true",
+                        dest="bench_decoders",
+                        help="Time the decoders on the audio files of the given directory, use the fastest one of each codec and exit")
+
+    parser.add_argument("--pipeline",
+                        action="store_true",
+                        dest="pipeline",
+                        help="Decode the files in concurrent ffmpeg processes and compute the DR in a separate pool of threads")
+
+    parser.add_argument("--decoders",
+                        type=int,
+                        metavar="N",
+                        dest="decoders",
+                        help="Number of files decoded at the same time by --pipeline (default: twice the compute threads)")
+
+    parser.add_argument("--compute_threads",
+                        type=int,
+                        metavar="N",
+                        dest="compute_threads",
+                        help="Number of compute threads of --pipeline (default: as the multi-Core mode)")
+
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        dest="no_cache",
+                        help="Do not use the cache of the results of the previous scans")
+
+    parser.add_argument("--profile",
+                        metavar="FILE",
+                        dest="profile",
+                        help="Write a json report of the time spent in each stage of the scan into FILE ('-' for the std_out)")
+
     parser.add_argument("-r", "--recursive",
                         action="store_true",
                         dest="recursive",
@@ -96,12 +133,17 @@ def parse_args():
                         dest="dump_database",
                         help="Dump the local DR database")
 
+    parser.add_argument("--check_database",
+                        action="store_true",
+                        dest="check_database",
+                        help="Check the statistics tables of the local DR database (-q hist/evol/codec/top_art) and rebuild them if needed")
+
     parser.add_argument("-q", "--query",
                         nargs="*",
                         dest="query",
                         help="""query the database. Options: [-q] [-q top #nr] [-q worst #nr] \n 
                                              [-q top_alb #nr] [-q worst_alb #nr] [-q top_art #nr #mt] 
-                                             [-q hist] [-q evol] [-q codec] \n 
+                                             [-q hist] [-q evol] [-q codec] [-q search terms] \n 
                                              [-q help] """ )
 
     parser.add_argument("-d", "--dr_database",
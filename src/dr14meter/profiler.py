@@ -0,0 +1,206 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Per-stage timing of a scan (--profile).
+#
+# The stages are walk, probe, decode, compute, hash, report, db and db_queue (the
+# albums waiting for the database writer thread, db is the time of its inserts). The
+# time of a stage nested in another one (hash in compute) is not counted in the outer one.
+# The cpu time is the time of the thread; the time of ffmpeg/ffprobe is in the
+# rusage of the children of the process.
+
+import contextlib
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from dr14meter.out_messages import print_msg, print_out
+
+
+profiler = None
+
+
+def enable_profile(worker=False):
+    global profiler
+    profiler = Profiler(worker)
+
+
+def is_profile_enabled():
+    return profiler is not None
+
+
+def profile_stage(name, file_name=None):
+    """Context manager timing a stage, it does nothing if the profile is not enabled"""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, file_name)
+
+
+def profile_file(file_name):
+    """Context manager setting the file the stages of the thread are accounted to"""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.file(file_name)
+
+
+def profile_bytes(name, n):
+    if profiler is not None:
+        profiler.add(name, profiler.current_file(), 0.0, 0.0, n, 0)
+
+
+def profile_time(name, file_name, wall, n_bytes=0):
+    """Adds a wall time measured by the caller, e.g. across the awaits of a coroutine"""
+    if profiler is not None:
+        profiler.add(name, file_name, wall, 0.0, n_bytes, 1)
+
+
+def worker_file_profile(file_name):
+    """In a worker process, the stages of the file to be returned to the main process"""
+    if profiler is None or not profiler.worker:
+        return None
+    return profiler.pop_file(file_name)
+
+
+def merge_file_profile(file_name, file_stages):
+    if profiler is not None and file_stages is not None:
+        profiler.merge_file(file_name, file_stages)
+
+
+def rusage_dict(who):
+    if resource is None:
+        return {}
+    ru = resource.getrusage(who)
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    maxrss = ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024
+    return {'utime': ru.ru_utime, 'stime': ru.ru_stime, 'max_rss_bytes': maxrss,
+            'read_blocks': ru.ru_inblock}
+
+
+class Profiler:
+
+    def __init__(self, worker=False):
+        self.worker = worker
+        self.t0 = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+        self.files = {}
+
+    def current_file(self):
+        return getattr(self.local, 'file_name', None)
+
+    @contextlib.contextmanager
+    def file(self, file_name):
+        prev = self.current_file()
+        self.local.file_name = file_name
+        try:
+            yield
+        finally:
+            self.local.file_name = prev
+
+    @contextlib.contextmanager
+    def stage(self, name, file_name=None):
+        if file_name is None:
+            file_name = self.current_file()
+
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        # [wall, cpu] of the nested stages
+        nested = [0.0, 0.0]
+        stack.append(nested)
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            self.add(name, file_name, wall - nested[0], cpu - nested[1], 0, 1)
+
+    def add(self, name, file_name, wall, cpu, n_bytes, count):
+        with self.lock:
+            add_stage(self.stages, name, wall, cpu, n_bytes, count)
+            if file_name is not None:
+                add_stage(self.files.setdefault(str(file_name), {}), name, wall, cpu, n_bytes, count)
+
+    def pop_file(self, file_name):
+        """The stages of the file, to be merged in the profile of the main process by merge_file"""
+        with self.lock:
+            return self.files.pop(str(file_name), None)
+
+    def merge_file(self, file_name, file_stages):
+        for name, st in file_stages.items():
+            self.add(name, file_name, st['wall'], st['cpu'], st['bytes'], st['count'])
+
+    def report(self):
+        with self.lock:
+            return {
+                'wall': time.perf_counter() - self.t0,
+                'stages': self.stages,
+                'rusage': {
+                    'self': rusage_dict(getattr(resource, 'RUSAGE_SELF', None)),
+                    'children': rusage_dict(getattr(resource, 'RUSAGE_CHILDREN', None)),
+                },
+                'files': self.files,
+            }
+
+
+def add_stage(stages, name, wall, cpu, n_bytes, count):
+    st = stages.get(name)
+    if st is None:
+        st = stages[name] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes': 0}
+    st['count'] += count
+    st['wall'] += wall
+    st['cpu'] += cpu
+    st['bytes'] += n_bytes
+
+
+def write_profile(file_name):
+    """Writes the report as json, to the standard output if file_name is '-'"""
+
+    if profiler is None:
+        return
+
+    from dr14meter.scan_plan import get_scan_plan
+
+    report = profiler.report()
+    report['plan'] = get_scan_plan().stages()
+    txt = json.dumps(report, indent=2)
+
+    if file_name == '-':
+        print_out(txt)
+        return
+
+    try:
+        with open(file_name, 'w') as f:
+            f.write(txt)
+        print_msg(f"- The profile has been written in the file: {file_name}")
+    except:
+        print_msg(f"File opening error [{file_name}]: {sys.exc_info()[0]}")
@@ -18,14 +18,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import concurrent.futures
+import json
+import os
 import pathlib
 import subprocess
 import re
 import hashlib
+import threading
 import numpy as np
 
 from dr14meter.audio_track import AudioTrack
 from dr14meter.dr14_global import get_ffmpeg_cmd
+from dr14meter.profiler import profile_stage
+from dr14meter.result_cache import get_result_cache
+from dr14meter.scan_plan import get_scan_plan
 
 
 def match_repetitive_title(data_txt):
@@ -36,6 +43,197 @@ class UnreadableAudioFileException(Exception):
     pass
 
 
+probe_pool = None
+lock_probe_pool = threading.Lock()
+
+
+def get_probe_pool():
+    """The threads running ffprobe, shared by all the scans"""
+    global probe_pool
+
+    with lock_probe_pool:
+        if probe_pool is None:
+            probe_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1))
+        return probe_pool
+
+
+def probe_file(ffprobe_cmd, file_path: pathlib.Path):
+    """The metadata of the file, read in the process by mutagen when possible, else by ffprobe"""
+
+    track = probe_file_mutagen(file_path)
+    if track is None:
+        track = probe_file_ffprobe(ffprobe_cmd, file_path)
+    return track
+
+
+def tag_value(values):
+    """A tag as printed by ffprobe: the values joined by ';', its first line, None if it is shorter than 2 chars"""
+    lines = ";".join(values).splitlines()
+    value = lines[0].strip() if lines else ""
+    return match_repetitive_title(value) if len(value) > 1 else None
+
+
+def set_tags(track, get_values):
+    """Sets the tags of the track, get_values(tag name as in ffprobe) is the list of the values of the tag"""
+
+    for field in ['album', 'artist', 'title', 'genre']:
+        value = tag_value(get_values(field))
+        if value is not None:
+            track[field] = value
+
+    for field, tag, f in [('track_nr', 'track', int), ('date', 'date', str), ('disk_nr', 'disc', int)]:
+        values = get_values(tag)
+        m = re.match(r"\s*(\d+)", values[0]) if values else None
+        if m is not None:
+            track[field] = f(m.group(1))
+
+
+# the vorbis comments renamed by ffmpeg
+VORBIS_COMMENTS = {'track': 'tracknumber', 'disc': 'discnumber'}
+
+FLAC_CHANNELS = {1: 'mono', 2: 'stereo'}
+
+
+def probe_file_mutagen(file_path: pathlib.Path):
+    """The metadata of a FLAC file read with mutagen, None if mutagen is not installed or if the file
+    must be read by ffprobe.
+
+    The album sha1 of the local database is computed on size, codec, duration and bitrate,
+    they are computed as ffprobe does: the duration of the stream, and the bitrate of the
+    file over its duration rounded to microseconds.
+    """
+
+    if file_path.suffix.lower() != '.flac':
+        return None
+
+    try:
+        from mutagen.flac import FLAC
+    except ImportError:
+        return None
+
+    try:
+        with file_path.open('rb') as f:
+            # ffmpeg reads the ID3 tags too
+            if f.read(4) != b'fLaC':
+                return None
+        audio = FLAC(file_path)
+        size = file_path.stat().st_size
+    except:
+        return None
+
+    info = audio.info
+    if info.total_samples <= 0 or info.sample_rate <= 0 or info.channels not in FLAC_CHANNELS:
+        return None
+
+    track = {'file_name': file_path.name}
+
+    tags = audio.tags
+    set_tags(track, lambda tag: tags.get(VORBIS_COMMENTS.get(tag, tag), []) if tags is not None else [])
+
+    duration_us = (info.total_samples * 1000000 + info.sample_rate // 2) // info.sample_rate
+
+    track['size'] = str(size)
+    track['bitrate'] = str(int(size * 8.0 * 1000000 / duration_us))
+    track['duration'] = float(f"{info.total_samples * (1.0 / info.sample_rate):.6f}")
+
+    track['codec'] = 'flac'
+    track['sampling_rate'] = str(info.sample_rate)
+    track['channel'] = FLAC_CHANNELS[info.channels]
+    track['bit'] = str(info.bits_per_sample)
+
+    return track
+
+
+# bits of a sample of the ffmpeg sample formats (the planar ones end with 'p')
+SAMPLE_FMT_BITS = {'u8': 8, 's16': 16, 's32': 32, 'flt': 32, 'dbl': 64, 's64': 64}
+
+
+def probe_file_ffprobe(ffprobe_cmd, file_path: pathlib.Path):
+    """The metadata of the file read by ffprobe, the same values as in its text output"""
+
+    try:
+        cmd = [ffprobe_cmd, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", file_path]
+        data_txt = subprocess.check_output(cmd, stderr=subprocess.DEVNULL, shell=False)
+    except:
+        raise UnreadableAudioFileException(f"problematic file: {file_path}")
+
+    try:
+        data_txt = data_txt.decode(encoding='UTF-8')
+    except:
+        data_txt = data_txt.decode(encoding='ISO-8859-1')
+
+    try:
+        data = json.loads(data_txt)
+        fmt = data.get('format', {})
+        streams = data.get('streams', [])
+        audio = [s for s in streams if s.get('codec_type') == 'audio'][0]
+    except:
+        raise UnreadableAudioFileException(f"problematic file: {file_path}")
+
+    track = {'file_name': file_path.name}
+
+    # the tags of the file, then those of the streams
+    tags = {}
+    for d in [fmt] + streams:
+        for k, v in d.get('tags', {}).items():
+            tags.setdefault(k.lower(), v)
+
+    set_tags(track, lambda tag: [tags[tag]] if tag in tags else [])
+
+    # the first value of the streams, then the one of the file
+    for field, key, pattern, f in [('size', 'size', r"(\d+)", str),
+                                   ('bitrate', 'bit_rate', r"(\d+)", str),
+                                   ('duration', 'duration', r"(\d+\.\d+)", float)]:
+        for d in streams + [fmt]:
+            m = re.fullmatch(pattern, str(d.get(key, "")).strip())
+            if m is not None and (key != 'size' or d is fmt):
+                track[field] = f(m.group(1))
+                break
+
+    read_stream_info(audio, track)
+    return track
+
+
+def probe_file_cached(ffprobe_cmd, file_path: pathlib.Path):
+    """The metadata of the file from the result cache, or read by ffprobe and cached"""
+
+    cache = get_result_cache()
+
+    with profile_stage('probe', file_path):
+        if cache is not None:
+            track = cache.get_metadata(file_path)
+            if track is not None:
+                return track
+
+        track = probe_file(ffprobe_cmd, file_path)
+
+        if cache is not None:
+            cache.put_metadata(file_path, track)
+
+    return track
+
+
+def read_stream_info(stream, track):
+    """The format of the audio stream of the ffprobe json output"""
+
+    track['codec'] = stream.get('codec_name', '')
+    track['sampling_rate'] = str(stream.get('sample_rate', ''))
+    track['channel'] = stream.get('channel_layout', f"{stream.get('channels', 0)} channels")
+
+    # ffprobe prints "s32 (24 bit)" when the bits of the codec are not those of the sample format
+    sample_fmt = stream.get('sample_fmt', '')
+    fmt_bits = SAMPLE_FMT_BITS.get(sample_fmt.rstrip('p'))
+    raw_bits = int(stream.get('bits_per_raw_sample', 0) or 0)
+
+    m = re.search(r"(\d+)", sample_fmt)
+    if raw_bits > 0 and raw_bits != fmt_bits:
+        track['bit'] = str(raw_bits)
+    elif m is not None:
+        track['bit'] = m.group(1)
+    else:
+        track['bit'] = "16"
+
+
 class RetrieveMetadata:
     re_flags = (re.MULTILINE | re.IGNORECASE | re.UNICODE)
 
@@ -44,11 +242,24 @@ class RetrieveMetadata:
         self._artist = collections.defaultdict(int)
         self._tracks = {}
         self._disk_nr = []
+        self._probes = {}
 
         # print a warning if ffmpeg not found
         get_ffmpeg_cmd()
         self.__ffprobe_cmd = "ffprobe"
 
+    def start_probe(self, files_path_list):
+        """Starts probing the files in background threads, the results are collected by scan_dir_metadata"""
+
+        if not get_scan_plan().probe:
+            return
+
+        pool = get_probe_pool()
+
+        for file_path in files_path_list:
+            if file_path.suffix in AudioTrack.FORMATS and file_path not in self._probes:
+                self._probes[file_path] = pool.submit(probe_file_cached, self.__ffprobe_cmd, file_path)
+
     def scan_dir_metadata(self, files_path_list):
 
         self._album = collections.defaultdict(int)
@@ -59,108 +270,38 @@ class RetrieveMetadata:
         # if files_path_list is None:
         #     files_path_list = sorted(dir_name.glob('*'))
 
+        if not get_scan_plan().probe:
+            return
+
+        self.start_probe(files_path_list)
+
         for file_path in files_path_list:
             if file_path.suffix in AudioTrack.FORMATS:
                 try:
-                    self.scan_file_orig(file_path)
+                    self.add_track(file_path, self._probes.pop(file_path).result())
                 except UnreadableAudioFileException as uafe:
-                    pass
-
+                    self._tracks[file_path.name] = None
 
     def scan_file_orig(self, file_path: pathlib.Path):
 
         try:
-            cmd = [self.__ffprobe_cmd, "-show_format", "-show_streams", file_path]
-            data_txt = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=False)
-        except:
+            track = probe_file_cached(self.__ffprobe_cmd, file_path)
+        except UnreadableAudioFileException:
             self._tracks[file_path.name] = None
-            raise UnreadableAudioFileException(f"problematic file: {file_path}")
-
-        try:
-            data_txt = data_txt.decode(encoding='UTF-8')
-        except:
-            data_txt = data_txt.decode(encoding='ISO-8859-1')
+            raise
 
-        track = {'file_name': file_path.name}
+        self.add_track(file_path, track)
 
-        pattern = r"[ \t\f\v]*([\S \t\f\v]+\S).*$"
+    def add_track(self, file_path, track):
 
-        # default (album) fields
-
-        m = re.search(r"^\s*album\s*\:" + pattern, data_txt, RetrieveMetadata.re_flags)
-        if m is not None:
-            track['album'] = match_repetitive_title(m.group(1))
+        if 'album' in track:
             self._album[track['album']] += 1
 
-        m = re.search(r"^\s*artist\s*\:" + pattern, data_txt, RetrieveMetadata.re_flags)
-        if m is not None:
-            track['artist'] = match_repetitive_title(m.group(1))
+        if 'artist' in track:
             self._artist[track['artist']] += 1
 
-        # repetitive fields
-
-        m = re.search(r"^\s*title\s*\:" + pattern, data_txt, RetrieveMetadata.re_flags)
-        if m is not None:
-            track['title'] = match_repetitive_title(m.group(1))
-
-
-        m = re.search(r"^\s*genre\s*\:" + pattern, data_txt, RetrieveMetadata.re_flags)
-        if m is not None:
-            track['genre'] = match_repetitive_title(m.group(1))
-
-        # simple tags
-
-        simple_tags = [
-            ('track_nr', r"^\s*track\s*\:\s*(\d+).*$", int),
-            ('date', r"^\s*date\s*\:\s*(\d+).*$", str),
-            ('disk_nr', r"^\s*disc\s*:\s*(\d+).*$", int),
-            ('size', r"^size=\s*(\d+)\s*$", str),
-            ('bitrate', r"^bit_rate=\s*(\d+)\s*$", str),
-            ('duration', r"^duration=\s*(\d+\.\d+)\s*$", float),
-        ]
-
-        for t, p, f in simple_tags:
-            m = re.search(p, data_txt, RetrieveMetadata.re_flags)
-            if m is not None:
-                track[t] = f(m.group(1))
-
-        self.__read_stream_info(data_txt, track)
         self._tracks[file_path.name] = track
 
-
-    def __read_stream_info(self, data_txt, track):
-
-
-        ##########################################
-        # string examples:
-        # Audio: flac, 44100 Hz, stereo, s16
-        # Stream #0:0(und): Audio: alac (alac / 0x63616C61), 44100 Hz, 2 channels, s16, 634 kb/s
-        # Stream #0:0(und): Audio: aac (LC) (mp4a / 0x6134706D), 44100 Hz, stereo, fltp, 255 kb/s (default
-        # Stream #0:0: Audio: flac, 44100 Hz, stereo, s16
-
-        m = re.search(r"Stream.*Audio:(.*)$", data_txt, RetrieveMetadata.re_flags)
-        if m != None:
-            fmt = m.group(1)
-
-        fmt = re.split(",", fmt)
-
-        #print( fmt )
-        track['codec'] = re.search(r"\s*(\w+)", fmt[0], RetrieveMetadata.re_flags).group(1)
-        track['sampling_rate'] = re.search(
-            r"\s*(\d+)", fmt[1], RetrieveMetadata.re_flags).group(1)
-        track['channel'] = re.search(
-            r"^\s*([\S][\s|\S]*[\S])\s*$", fmt[2], RetrieveMetadata.re_flags).group(1)
-
-        m = re.search(r"\((\d+) bit\)", fmt[3], RetrieveMetadata.re_flags)
-        if m != None:
-            track['bit'] = m.group(1)
-        else:
-            m = re.search(r"(\d+)", fmt[3], RetrieveMetadata.re_flags)
-            if m != None:
-                track['bit'] = m.group(1)
-            else:
-                track['bit'] = "16"
-
     def album_len(self):
         return len(self._tracks)
 
@@ -186,8 +327,9 @@ class RetrieveMetadata:
         else:
             return collections.Counter(self._album).most_common(1)[0][0]
 
-    def track_unreadable_failure(self, file_path):
-        return file_path.name not in self._tracks
+    def track_unreadable_failure(self, file_name):
+        # the failed files are stored as None
+        return self._tracks.get(pathlib.Path(file_name).name) is None
 
     def get_album_sha1(self, title=None):
 
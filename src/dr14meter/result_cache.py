@@ -0,0 +1,247 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Persistent cache of the analysis results and of the metadata of the files.
+#
+# An entry is valid while the device, inode, size and mtime of the file are unchanged.
+# When they change, the DR values of a flac file are still used if the MD5 of its samples
+# (STREAMINFO) is the same: rewriting the tags, as --tag does, does not change the audio.
+# The other formats have no such checksum, any change of the file is a cache miss.
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from dr14meter.out_messages import print_msg
+
+
+CACHE_MAX_ENTRIES = 500000
+CACHE_MAX_AGE = 180 * 24 * 3600
+
+cache_enabled = True
+result_cache = None
+lock_cache = threading.Lock()
+
+
+def set_cache_enabled(f=True):
+    global cache_enabled
+    cache_enabled = f
+
+
+def is_cache_enabled():
+    return cache_enabled
+
+
+def get_cache_directory(create=True):
+
+    p = os.environ.get('XDG_CACHE_HOME')
+
+    if p is None or not os.path.isabs(p):
+        p = os.path.expanduser('~/.cache')
+
+    cache_dir = os.path.join(p, 'dr14meter')
+
+    if not os.path.isdir(cache_dir) and create:
+        os.makedirs(cache_dir)
+
+    return cache_dir
+
+
+def get_result_cache():
+    """The cache of the process, None if it is disabled or it cannot be opened"""
+
+    global result_cache
+    global cache_enabled
+
+    if not cache_enabled:
+        return None
+
+    with lock_cache:
+        if result_cache is None:
+            try:
+                result_cache = ResultCache(os.path.join(get_cache_directory(), "results.db"))
+            except:
+                print_msg(f"Unable to open the result cache: {sys.exc_info()[1]}")
+                cache_enabled = False
+        return result_cache
+
+
+def flac_audio_id(f):
+    # the first metadata block is always STREAMINFO, the MD5 of the samples is in its last 16 bytes
+    head = f.read(42)
+    if len(head) < 42 or head[:4] != b'fLaC' or head[4] & 0x7F != 0:
+        return None
+    md5 = head[26:42]
+    return None if md5 == bytes(16) else 'flac:' + md5.hex()
+
+
+def get_audio_id(file_name):
+    """An identity of the audio content of the file that does not depend on its tags, None if not available.
+
+    Only the flac files have one: the MD5 of STREAMINFO covers all the samples.
+    """
+
+    if os.path.splitext(file_name)[1].lower() != '.flac':
+        return None
+
+    try:
+        with open(file_name, 'rb') as f:
+            return flac_audio_id(f)
+    except:
+        return None
+
+
+def file_key(st):
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class ResultCache:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("pragma journal_mode=WAL")
+        self.conn.execute("pragma synchronous=NORMAL")
+
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS Entry (
+                    path TEXT PRIMARY KEY,
+                    dev INTEGER,
+                    ino INTEGER,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    audio_id TEXT,
+                    result TEXT,
+                    metadata TEXT,
+                    atime REAL
+                ) """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS Entry_atime ON Entry ( atime )")
+
+        self.evict()
+
+    def get_result(self, file_name):
+        """The cached analysis result of the file or None"""
+
+        path = os.path.abspath(file_name)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        with self.lock:
+            row = self.conn.execute(
+                "select dev, ino, size, mtime_ns, audio_id, result from Entry where path = ?", (path,)).fetchone()
+
+            if row is None or row[5] is None:
+                return None
+
+            if tuple(row[:4]) != file_key(st):
+                audio_id = get_audio_id(path)
+                if audio_id is None or audio_id != row[4]:
+                    return None
+                # only the tags have been changed: the probed metadata are stale
+                with self.conn:
+                    self.conn.execute(
+                        "update Entry set dev = ?, ino = ?, size = ?, mtime_ns = ?, metadata = NULL where path = ?",
+                        file_key(st) + (path,))
+
+            with self.conn:
+                self.conn.execute("update Entry set atime = ? where path = ?", (time.time(), path))
+
+        return json.loads(row[5])
+
+    def get_metadata(self, file_name):
+        """The cached metadata of the file or None"""
+
+        path = os.path.abspath(file_name)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        with self.lock:
+            row = self.conn.execute(
+                "select dev, ino, size, mtime_ns, metadata from Entry where path = ?", (path,)).fetchone()
+
+        if row is None or row[4] is None or tuple(row[:4]) != file_key(st):
+            return None
+
+        return json.loads(row[4])
+
+    def put_result(self, file_name, result):
+        self.__put(file_name, 'result', result)
+
+    def put_metadata(self, file_name, metadata):
+        self.__put(file_name, 'metadata', metadata)
+
+    def __put(self, file_name, field, value):
+
+        path = os.path.abspath(file_name)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+
+        value = json.dumps(value, default=lambda x: x.item())
+
+        with self.lock:
+            row = self.conn.execute(
+                "select dev, ino, size, mtime_ns, audio_id from Entry where path = ?", (path,)).fetchone()
+
+            with self.conn:
+                if row is not None and tuple(row[:4]) == file_key(st):
+                    self.conn.execute(f"update Entry set {field} = ?, atime = ? where path = ?",
+                                      (value, time.time(), path))
+                    return
+
+                audio_id = get_audio_id(path)
+
+                # the file has changed: the metadata are stale, the result is kept while the audio is the same
+                # (the probe of a retagged file usually puts its metadata before the result is read)
+                if field == 'metadata' and audio_id is not None and row is not None and audio_id == row[4]:
+                    clear = ""
+                else:
+                    clear = ", result = NULL" if field == 'metadata' else ", metadata = NULL"
+
+                self.conn.execute(
+                    f"""insert into Entry ( path, dev, ino, size, mtime_ns, audio_id, {field}, atime )
+                        values ( ?, ?, ?, ?, ?, ?, ?, ? )
+                        on conflict ( path ) do update set dev = excluded.dev, ino = excluded.ino,
+                            size = excluded.size, mtime_ns = excluded.mtime_ns, audio_id = excluded.audio_id{clear},
+                            {field} = excluded.{field}, atime = excluded.atime""",
+                    (path,) + file_key(st) + (audio_id, value, time.time()))
+
+    def evict(self, max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE):
+        """Removes the entries not used for max_age seconds and the least recently used beyond max_entries"""
+
+        with self.lock, self.conn:
+            self.conn.execute("delete from Entry where atime < ?", (time.time() - max_age,))
+            self.conn.execute(
+                "delete from Entry where path in ( select path from Entry order by atime desc limit -1 offset ? )",
+                (max_entries,))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("delete from Entry")
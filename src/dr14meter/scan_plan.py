@@ -0,0 +1,88 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The stages run by a scan.
+#
+# decode and dr are always run; the sha1 of the tracks (fingerprint) is only read by the
+# database, the metadata of ffprobe/mutagen (probe) by the database and the extended
+# tables. A scan with -b -n and the database disabled only decodes the files.
+
+import threading
+
+
+# the report files of -t, in the order they are written
+REPORT_CODES = 'bthw'
+
+
+class ScanPlan:
+    """The stages of a scan, everything is run by default; write_album and write_results follow it"""
+
+    def __init__(self, fingerprint=True, probe=True, tag=False, db=True, reports=REPORT_CODES, std_out=False):
+        self.fingerprint = fingerprint
+        self.probe = probe
+        self.tag = tag
+        self.db = db
+        self.reports = reports
+        self.std_out = std_out
+
+    def stages(self):
+        stages = ['decode', 'dr']
+        for name in ['fingerprint', 'probe', 'tag', 'db']:
+            if getattr(self, name):
+                stages.append(name)
+        if self.std_out:
+            stages.append('report:stdout')
+        return stages + [f"report:{code}" for code in self.reports]
+
+    def __str__(self):
+        return ", ".join(self.stages())
+
+
+scan_plan = ScanPlan()
+lock_plan = threading.Lock()
+
+
+def plan_scan(options, db_enabled):
+    """The minimal plan of the options"""
+
+    if options.scan_file:
+        # -f prints the DR, peak and rms of a file
+        return ScanPlan(fingerprint=False, probe=False, db=False, reports='', std_out=True)
+
+    # the files and the database are not written with -n
+    out = not options.turn_off_out
+    reports = ''
+    if out:
+        reports = REPORT_CODES if 'a' in options.out_tables else \
+            ''.join(c for c in REPORT_CODES if c in options.out_tables)
+
+    db = db_enabled and out
+    # the basic table has neither the title nor the codec of the tracks
+    extended = not options.basic_table and (len(reports) > 0 or options.print_std_out)
+
+    return ScanPlan(fingerprint=db, probe=db or extended, tag=options.tag, db=db, reports=reports,
+                    std_out=options.print_std_out)
+
+
+def set_scan_plan(plan):
+    global scan_plan
+    with lock_plan:
+        scan_plan = plan
+
+
+def get_scan_plan():
+    with lock_plan:
+        return scan_plan
@@ -0,0 +1,202 @@
+# dr14meter: compute the DR14 value of the given audio files
+# Copyright (C) 2024  pe7ro
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Native reader of RIFF/WAVE, RF64/BW64 and Sony Wave64 files.
+# The data chunk is memory mapped and exposed as a numpy view without copies,
+# the samples are converted to float only when a range of frames is read.
+
+import mmap
+import pathlib
+import struct
+
+import numpy
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Wave64 GUIDs, the first 4 bytes are the RIFF ids
+W64_GUID_SUFFIX = {
+    b'riff': bytes.fromhex('2e91cf11a5d628db04c10000'),
+    b'wave': bytes.fromhex('f3acd3118cd100c04f8edb8a'),
+    b'fmt ': bytes.fromhex('f3acd3118cd100c04f8edb8a'),
+    b'data': bytes.fromhex('f3acd3118cd100c04f8edb8a'),
+}
+
+
+class WavFormatError(Exception):
+    pass
+
+
+def parse_fmt_chunk(data):
+    """Returns (format tag, channels, sampling rate, bits per sample) of a fmt chunk."""
+    if len(data) < 16:
+        raise WavFormatError("fmt chunk too short")
+
+    tag, channels, Fs, _, block_align, bits = struct.unpack('<HHIIHH', data[:16])
+
+    if tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(data) < 40:
+            raise WavFormatError("extensible fmt chunk too short")
+        # the sub format GUID starts with the format tag
+        tag = struct.unpack('<H', data[24:26])[0]
+
+    if channels == 0:
+        raise WavFormatError("no channels")
+
+    # the container size of the samples is given by the block align
+    bits = 8 * (block_align // channels) if block_align else bits
+
+    return tag, channels, Fs, bits
+
+
+def riff_chunks(buf, offset, end):
+    """(id, offset, size) of the chunks of a RIFF/RF64 file"""
+    while offset + 8 <= end:
+        chunk_id, size = struct.unpack_from('<4sI', buf, offset)
+        yield chunk_id, offset + 8, size
+        offset = offset + 8 + size + (size & 1)
+
+
+def w64_chunks(buf, offset, end):
+    """(id, offset, size) of the chunks of a Wave64 file, the ids are shortened to 4 bytes"""
+    while offset + 24 <= end:
+        guid = bytes(buf[offset:offset + 16])
+        size = struct.unpack_from('<Q', buf, offset + 16)[0]
+        if size < 24:
+            raise WavFormatError("invalid Wave64 chunk")
+        chunk_id = guid[:4] if W64_GUID_SUFFIX.get(guid[:4]) == guid[4:] else guid
+        yield chunk_id, offset + 24, size - 24
+        offset = offset + ((size + 7) & ~7)
+
+
+def sample_dtype(tag, bits):
+    if tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits == 32:
+            return numpy.dtype('<f4')
+        if bits == 64:
+            return numpy.dtype('<f8')
+    elif tag == WAVE_FORMAT_PCM:
+        if bits == 8:
+            return numpy.dtype('u1')
+        if bits == 16:
+            return numpy.dtype('<i2')
+        if bits == 24:
+            # packed samples, seen as 3 bytes each
+            return numpy.dtype('u1')
+        if bits == 32:
+            return numpy.dtype('<i4')
+
+    raise WavFormatError(f"unsupported wav format: tag {tag:#06x}, {bits} bit")
+
+
+def int24_to_int32(X):
+    """Packed 24 bit samples, an uint8 array of shape (frames, ch, 3), to int32"""
+    Z = numpy.zeros(X.shape[:-1] + (4,), dtype=numpy.uint8)
+    Z[..., 1:] = X
+    return Z.view('<i4')[..., 0] >> 8
+
+
+class WavFile:
+    """A memory mapped wav file.
+
+    data is a zero-copy view of the samples, shape (frames, channels) or
+    (frames, channels, 3) for packed 24 bit files; read_frames converts a range of
+    frames to float, in the same scale used for the files decoded by ffmpeg.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = pathlib.Path(file_name)
+
+        with self.file_name.open('rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._parse()
+        except:
+            self.close()
+            raise
+
+    def _parse(self):
+        mm = self._mm
+        end = len(mm)
+
+        head = mm[:12]
+        ds64_data_size = None
+
+        if head[:4] in (b'RIFF', b'RF64', b'BW64') and head[8:12] == b'WAVE':
+            chunks = riff_chunks(mm, 12, end)
+        elif head[:4] == b'riff' and mm[4:16] == W64_GUID_SUFFIX[b'riff'] and mm[24:28] == b'wave':
+            chunks = w64_chunks(mm, 40, end)
+        else:
+            raise WavFormatError("not a wav file")
+
+        fmt = None
+        data = None
+
+        for chunk_id, offset, size in chunks:
+            if chunk_id == b'ds64':
+                # RF64: the real sizes of the file and of the data chunk
+                ds64_data_size = struct.unpack_from('<QQ', mm, offset)[1]
+            elif chunk_id == b'fmt ':
+                fmt = parse_fmt_chunk(mm[offset:offset + size])
+            elif chunk_id == b'data':
+                if size == 0xFFFFFFFF and ds64_data_size is not None:
+                    size = ds64_data_size
+                data = (offset, size)
+                break
+
+        if fmt is None or data is None:
+            raise WavFormatError("fmt or data chunk not found")
+
+        self.format_tag, self.channels, self.Fs, bits = fmt
+        self.sample_width = bits // 8
+
+        dtype = sample_dtype(self.format_tag, bits)
+
+        offset, size = data
+        frame_bytes = self.channels * self.sample_width
+        # a truncated file is read up to its last complete frame
+        self.frames = min(size, end - offset) // frame_bytes
+
+        shape = (self.frames, self.channels)
+        if bits == 24:
+            shape = shape + (3,)
+
+        self.data = numpy.frombuffer(mm, dtype=dtype, count=self.frames * frame_bytes // dtype.itemsize,
+                                     offset=offset).reshape(shape)
+
+    def read_frames(self, start=0, stop=None):
+        """The frames [start, stop) as a float array of shape (frames, channels)."""
+        X = self.data[start:stop]
+
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            return X
+
+        if self.sample_width == 2:
+            return X / numpy.float32(2 ** 15 + 1)
+        elif self.sample_width == 3:
+            return int24_to_int32(X).astype(numpy.float32) / numpy.float32(2 ** 23 + 1)
+        elif self.sample_width == 4:
+            return X / numpy.float32(2 ** 31 + 1)
+        else:
+            return (X.astype(numpy.float32) - 128) / numpy.float32(2 ** 7 + 1)
+
+    def close(self):
+        # the map is released when the last view of the samples is gone
+        self.data = None
+        self._mm = None
@@ -23,7 +23,7 @@ import pathlib
 import dr14meter.dr14_global as dr14
 import dr14meter.table as table
 
-from dr14meter.database.database import dr_database_singletone
+from dr14meter.database.writer import write_records
 
 
 class WriteDr:
@@ -38,20 +38,20 @@ class WriteDr:
         return self.__dr_database_compatible
 
     def write_to_local_dr_database(self, drm):
-        db = dr_database_singletone().get()
-        db.open_insert_session()
+        write_records([self.album_record(drm)])
+
+    def album_record(self, drm):
+        """The album and its tracks as plain data, to be written by insert_album_record"""
 
         album_title = drm.meta_data.get_album_title()
 
         if album_title is None:
             album_title = pathlib.Path(drm.dir_name).name
 
-        album_sha1 = drm.meta_data.get_album_sha1()
         album_artist = drm.meta_data.get_album_artist()
 
-        db.insert_album(album_sha1, album_title,
-                        int(drm.dr14),
-                        disk_nr=drm.meta_data.get_disk_nr(), artist=album_artist[0])
+        record = {'sha1': drm.meta_data.get_album_sha1(), 'title': album_title, 'dr': int(drm.dr14),
+                  'disk_nr': drm.meta_data.get_disk_nr(), 'artist': album_artist[0], 'tracks': []}
 
         for element in drm.res_list:
 
@@ -60,32 +60,19 @@ class WriteDr:
             if drm.meta_data.track_unreadable_failure(curr_file_name):
                 continue
 
-            track_sha1 = element['sha1']
-            title = drm.meta_data.get_value(curr_file_name, 'title')
-            dr = element['dr14']
-            rms = element['dB_rms']
-            peak = element['dB_peak']
-            duration = drm.meta_data.get_value(curr_file_name, 'duration')
-            size = drm.meta_data.get_value(curr_file_name, 'size')
-            bit = drm.meta_data.get_value(curr_file_name, 'bit')
-            bitrate = drm.meta_data.get_value(curr_file_name, 'bitrate')
-            sampling_rate = drm.meta_data.get_value(curr_file_name, 'sampling_rate')
-            codec = drm.meta_data.get_value(curr_file_name, 'codec')
-            artist = drm.meta_data.get_value(curr_file_name, 'artist')
-            genre = drm.meta_data.get_value(curr_file_name, 'genre')
-            date = drm.meta_data.get_value(curr_file_name, 'date')
-            track_nr = drm.meta_data.get_value(curr_file_name, 'track_nr')
-
-            if title == None:
-                title = curr_file_name
-
-            db.insert_track(track_sha1, title,
-                            dr, rms, peak, duration,
-                            codec,  bit, bitrate, sampling_rate,
-                            album_sha1, artist,
-                            genre, date, track_nr, size)
-
-        db.commit_insert_session()
+            track = {'sha1': element['sha1'], 'dr': element['dr14'],
+                     'rms': element['dB_rms'], 'peak': element['dB_peak']}
+
+            for k in ['title', 'duration', 'size', 'bit', 'bitrate', 'sampling_rate',
+                      'codec', 'artist', 'genre', 'date', 'track_nr']:
+                track[k] = drm.meta_data.get_value(curr_file_name, k)
+
+            if track['title'] == None:
+                track['title'] = curr_file_name
+
+            record['tracks'].append(track)
+
+        return record
 
     def write_query_result(self, res_dl, tm, table_title, desired_keys=None, desired_keys_titles=None):
 
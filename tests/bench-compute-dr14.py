@@ -0,0 +1,80 @@
+import math
+import sys
+import time
+
+import numpy as np
+
+from dr14meter.audio_math import audio_min, max_dynamic, decibel_u, dr_rms
+from dr14meter.compute_dr14 import compute_dr14
+
+# usage: python bench-compute-dr14.py [minutes ...]
+# compares compute_dr14 with the previous block-by-block implementation
+
+
+def compute_dr14_loop(Y, Fs):
+    s = Y.shape
+    ch = s[1]
+    block_samples = 3 * (Fs + (60 if Fs == 44100 else 0))
+
+    seg_cnt = int(math.floor(s[0] / block_samples) + 1)
+
+    curr_sam = 0
+    rms = np.zeros((seg_cnt, ch))
+    peaks = np.zeros((seg_cnt, ch))
+
+    for i in range(seg_cnt - 1):
+        rms[i, :] = np.sqrt(2.0 * np.sum(Y[curr_sam:curr_sam + block_samples, :]**2.0, 0) /
+                            float(block_samples))
+        peaks[i, :] = np.max(np.abs(Y[curr_sam:curr_sam + block_samples, :]), 0)
+        curr_sam = curr_sam + block_samples
+
+    i = seg_cnt - 1
+
+    if curr_sam < s[0]:
+        rms[i, :] = dr_rms(Y[curr_sam:s[0] - 1, :])
+        peaks[i, :] = np.max(np.abs(Y[curr_sam:s[0] - 1, :]), 0)
+
+    peaks = np.sort(peaks, 0)
+    rms = np.sort(rms, 0)
+
+    n_blk = max(int(math.floor(seg_cnt * 0.2)), 1)
+    r = np.arange(seg_cnt - n_blk, seg_cnt)
+
+    rms_sum = np.sum(rms[r, :]**2, 0)
+    ch_dr14 = -20.0 * np.log10(np.sqrt(rms_sum / n_blk) * 1.0 / peaks[seg_cnt - 2, :])
+
+    err_i = np.logical_or(rms_sum < audio_min(), np.abs(ch_dr14) > max_dynamic(24))
+    ch_dr14[err_i] = 0.0
+
+    return round(np.mean(ch_dr14)), decibel_u(np.max(peaks), 1.0), decibel_u(np.mean(dr_rms(Y)), 1.0)
+
+
+def make_track(minutes, Fs=44100, ch=2):
+    rng = np.random.default_rng(0)
+    n = int(minutes * 60 * Fs)
+    env = 0.1 + 0.9 * np.abs(np.sin(np.arange(n, dtype=np.float32) / (7 * Fs)))
+    y = rng.standard_normal((n, ch), dtype=np.float32) * (8000 * env)[:, None]
+    return (y.clip(-32768, 32767).astype(np.int16) / np.float32(2 ** 15 + 1))
+
+
+def timeit(f, *args, repeat=3):
+    best = math.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        res = f(*args)
+        best = min(best, time.perf_counter() - t)
+    return best, res
+
+
+np.seterr(all='ignore')
+
+minutes_list = [float(x) for x in sys.argv[1:]] or [5, 60, 180]
+
+print(f"{'minutes':>8} {'loop [s]':>10} {'vector [s]':>11} {'speedup':>8}  identical")
+for minutes in minutes_list:
+    Y = make_track(minutes)
+    t_loop, r_loop = timeit(compute_dr14_loop, Y, 44100)
+    t_vec, r_vec = timeit(compute_dr14, Y, 44100)
+    same = all(a == b for a, b in zip(r_loop, r_vec))
+    print(f"{minutes:8g} {t_loop:10.3f} {t_vec:11.3f} {t_loop / t_vec:7.1f}x  {same}")
+    del Y
@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import time
+
+# usage: python bench-database.py [tracks [tracks per album]]
+# inserts synthetic albums in a new local DR database, one insert session per album
+# as done by WriteDr.write_to_local_dr_database
+
+tmp_dir = tempfile.TemporaryDirectory()
+os.environ['XDG_CONFIG_HOME'] = tmp_dir.name
+
+from dr14meter import dr14_config
+from dr14meter.database.database import dr_database_singletone
+
+
+def insert_albums(db, tracks, per_album):
+    codecs = ['flac', 'mp3', 'vorbis', 'aac']
+    genres = [f"genre {i}" for i in range(40)]
+
+    for a in range(0, tracks, per_album):
+        album_sha1 = f"{a:040x}"
+        artist = f"artist {a // (per_album * 5)}"
+
+        db.open_insert_session()
+        db.insert_album(album_sha1, f"album {a}", 10, artist=artist)
+
+        for t in range(a, min(a + per_album, tracks)):
+            db.insert_track(f"{t + (1 << 100):040x}", f"title {t}",
+                            t % 20, -16.0, -0.5, 240.0,
+                            codecs[t % len(codecs)], 16, 1411, 44100,
+                            album_sha1, artist, genres[t % len(genres)], 1970 + t % 50, t % per_album + 1, 40000000)
+
+        db.commit_insert_session()
+
+
+if __name__ == '__main__':
+    tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    per_album = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    dr14_config.set_db_path(os.path.join(tmp_dir.name, 'dr14_bench.db'))
+
+    db = dr_database_singletone().get()
+    db.build_database()
+
+    t = time.perf_counter()
+    insert_albums(db, tracks, per_album)
+    t = time.perf_counter() - t
+
+    n = db.query("select count(*) from Track")[0][0]
+    print(f"{n} tracks in {t:.2f} s, {n / t:.0f} tracks/s")
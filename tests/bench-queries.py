@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# usage: python bench-queries.py [tracks]
+# builds a synthetic local DR database (1000000 tracks by default) with the version 1
+# schema and times the queries of database/query.py after each migration ('-' when the
+# query needs a later version, the statistics queries join the tracks before the version 3).
+# The query plans of the last version must not scan a large table without an index, nor
+# sort the rows of the top/worst queries in a temp b-tree.
+
+tmp_dir = tempfile.TemporaryDirectory()
+os.environ['XDG_CONFIG_HOME'] = tmp_dir.name
+
+from dr14meter import dr14_config
+from dr14meter.database import query as q
+from dr14meter.database import database as db_mod
+from dr14meter.database.database import dr_database_singletone
+
+QUERIES = [q.query_top_dr, q.query_worst_dr, q.query_top_albums_dr, q.query_worst_albums_dr,
+           q.query_top_artists, q.query_dr_histogram, q.query_date_dr_evolution, q.query_dr_codec]
+
+# searches timed on the last version: a title, an artist, a prefix and a word of every title
+SEARCHES = [["title", "123457"], ["artist", "4242"], ["titl*", "99999"], ["title"]]
+
+# dimension and summary tables with a few rows, they can be scanned
+SMALL_TABLES = {'dr', 'date', 'codec', 'genre', 'stat_dr', 'stat_date', 'stat_codec', 'stat_artist'}
+# the queries sorting the rows by an aggregate, they need a temp b-tree
+AGGREGATES = {'query_top_artists', 'query_dr_histogram', 'query_date_dr_evolution', 'query_dr_codec'}
+
+
+def fill(db, tracks, per_album=10, albums_per_session=1000):
+    codecs = ['flac', 'mp3', 'vorbis', 'aac']
+    genres = [f"genre {i}" for i in range(40)]
+
+    a = 0
+    while a < tracks:
+        db.open_insert_session()
+        for a in range(a, min(a + per_album * albums_per_session, tracks), per_album):
+            album_sha1 = f"{a:040x}"
+            artist = f"artist {a // (per_album * 5)}"
+            db.insert_album(album_sha1, f"album {a}", a % 17, artist=artist)
+
+            for t in range(a, min(a + per_album, tracks)):
+                db.insert_track(f"{t + (1 << 100):040x}", f"title {t}",
+                                t % 20, -16.0, -0.5, 240.0,
+                                codecs[t % len(codecs)], 16, 1411, 44100,
+                                album_sha1, artist, genres[t % len(genres)], 1970 + t % 50, t % per_album + 1,
+                                40000000)
+        db.commit_insert_session()
+        a = a + per_album
+
+
+def params(query):
+    if isinstance(query, q.query_top_artists):
+        return query.min_track, query.limit
+    if isinstance(query, (q.query_dr_histogram, q.query_date_dr_evolution, q.query_dr_codec)):
+        return ()
+    return query.limit,
+
+
+def time_queries(db):
+    times = {}
+    for cls in QUERIES:
+        query = cls()
+        t = time.perf_counter()
+        try:
+            query.exec_query()
+            times[cls.__name__] = time.perf_counter() - t
+        except sqlite3.OperationalError:
+            times[cls.__name__] = None
+    return times
+
+
+def plan_problems(db):
+    problems = []
+    for cls in QUERIES:
+        query = cls()
+        plan = db.query("explain query plan " + query.get_query(), params(query))
+        for row in plan:
+            detail = row[3]
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                table = detail.split()[1]
+                bad = table.lower() not in SMALL_TABLES and not table.startswith("(")
+            else:
+                bad = "TEMP B-TREE" in detail and cls.__name__ not in AGGREGATES
+            if bad:
+                problems.append((cls.__name__, detail))
+    return problems
+
+
+if __name__ == '__main__':
+    tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    dr14_config.set_db_path(os.path.join(tmp_dir.name, 'dr14_bench.db'))
+
+    db = dr_database_singletone().get()
+    conn = db.connection()
+    conn.executescript(db.dr14_db_main_structure_v1())
+
+    t = time.perf_counter()
+    fill(db, tracks)
+    print(f"{tracks} tracks inserted in {time.perf_counter() - t:.1f} s")
+
+    times = {1: time_queries(db)}
+
+    for v, script in db_mod.DB_MIGRATIONS:
+        t = time.perf_counter()
+        db.ungrade_db(v)
+        print(f"migrated to version {v} in {time.perf_counter() - t:.1f} s")
+        times[v] = time_queries(db)
+
+    print(f"\n{'query':28s}" + "".join(f"{'v' + str(v) + ' [s]':>9s}" for v in times))
+    for name in times[1]:
+        print(f"{name:28s}" + "".join("        -" if t[name] is None else f"{t[name]:9.3f}" for t in times.values()))
+
+    print()
+    for terms in SEARCHES:
+        query = q.query_search(terms)
+        t = time.perf_counter()
+        n = len(query.exec_query())
+        print(f"search {' '.join(terms):20s} {time.perf_counter() - t:9.4f} s  {n} results")
+
+    problems = plan_problems(db)
+    for name, detail in problems:
+        print(f"plan of {name}: {detail}")
+
+    sys.exit(1 if problems else 0)
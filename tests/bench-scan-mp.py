@@ -0,0 +1,69 @@
+import concurrent.futures
+import pathlib
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from dr14meter.dynamic_range_meter import run_mp, collect_results, get_process_pool, shutdown_process_pool
+
+# usage: python bench-scan-mp.py [files [minutes [max workers]]]
+# analyses an album of synthetic wav files with threads and with the process pool
+
+
+def make_album(dir_name, files, minutes, Fs=44100):
+    rng = np.random.default_rng(0)
+    n = int(minutes * 60 * Fs)
+    env = 0.1 + 0.9 * np.abs(np.sin(np.arange(n, dtype=np.float32) / (7 * Fs)))
+    job_queue = []
+    for i in range(files):
+        y = rng.standard_normal((n, 2), dtype=np.float32) * (8000 * env)[:, None]
+        file_name = pathlib.Path(dir_name) / f"{i:02d}.wav"
+        with wave.open(str(file_name), 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(Fs)
+            w.writeframes(y.clip(-32768, 32767).astype('<i2').tobytes())
+        job_queue.append(file_name)
+    return job_queue
+
+
+def scan_threads(job_queue, workers):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return collect_results([executor.submit(run_mp, x) for x in job_queue], job_queue)
+
+
+def scan_processes(job_queue, workers):
+    executor = get_process_pool(workers)
+    return collect_results([executor.submit(run_mp, x) for x in job_queue], job_queue)
+
+
+def timeit(f, *args):
+    t = time.perf_counter()
+    res = f(*args)
+    return time.perf_counter() - t, res
+
+
+if __name__ == '__main__':
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        job_queue = make_album(tmp_dir, files, minutes)
+        reference = [run_mp(x) for x in job_queue]
+
+        print(f"{'workers':>8} {'threads [s]':>12} {'processes [s]':>14}  identical")
+        workers = 1
+        while workers <= max_workers:
+            t_thr, r_thr = timeit(scan_threads, job_queue, workers)
+            # the first scan starts the workers, the second one measures the warm pool
+            scan_processes(job_queue, workers)
+            t_proc, r_proc = timeit(scan_processes, job_queue, workers)
+            same = r_thr == reference and r_proc == reference
+            print(f"{workers:8d} {t_thr:12.3f} {t_proc:14.3f}  {same}")
+            workers = workers * 2
+
+        shutdown_process_pool()
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+# usage: python bench-startup.py [budget ms]
+# measures the import time (python -X importtime) of the command line: -v and -q must
+# not load numpy nor the analysis modules, the scan must not load the plot, compressor,
+# tagging and query modules and must import within the budget (250 ms by default,
+# numpy alone takes about 90 ms).
+
+ANALYSIS = ['matplotlib', 'scipy', 'mutagen', 'dr14meter.audio_analysis', 'dr14meter.plot',
+            'dr14meter.compressor']
+
+# the modules imported by main() before the scan of the directories
+SCAN_IMPORTS = ("import numpy ; "
+                "from dr14meter.dynamic_range_meter import DynamicRangeMeter ; "
+                "from dr14meter.dr14_utils import scan_dir_list, scan_files_list ; "
+                "from dr14meter.dir_walker import walk_albums ; "
+                "from dr14meter.result_cache import set_cache_enabled ; "
+                "from dr14meter.database.writer import start_db_writer")
+
+RUNS = [
+    # name, python arguments, modules not to be imported, budget
+    ('-v', ['-m', 'dr14meter', '-v'], ANALYSIS + ['numpy'], False),
+    ('-q top', ['-m', 'dr14meter', '-q', 'top'], ANALYSIS + ['numpy'], False),
+    ('scan', ['-c', "import dr14meter.dr14_main ; " + SCAN_IMPORTS],
+     ANALYSIS + ['dr14meter.database.query', 'dr14meter.database.database_utils', 'dr14meter.tagger'], True),
+]
+
+
+def import_times(args, env):
+    """The modules imported by python args and the cumulative import time [ms] of the top level ones"""
+
+    r = subprocess.run([sys.executable, '-X', 'importtime'] + args, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    modules = set()
+    total = 0.0
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # the top level imports are not indented
+        if not name.startswith('  '):
+            total = total + int(cumulative) / 1000.0
+    return modules, total
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 250.0
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    env = dict(os.environ)
+    env['XDG_CONFIG_HOME'] = tmp_dir.name
+
+    problems = []
+    for name, args, forbidden, timed in RUNS:
+        modules, total = import_times(args, env)
+        print(f"{name:8s} {total:8.1f} ms  {len(modules)} modules")
+
+        for m in forbidden:
+            if m in modules:
+                problems.append(f"{name}: {m} is imported")
+        if timed and total > budget:
+            problems.append(f"{name}: {total:.1f} ms exceeds the budget of {budget:.0f} ms")
+
+    if os.listdir(tmp_dir.name):
+        problems.append(f"the configuration directory has been created in {tmp_dir.name}")
+
+    for p in problems:
+        print(p)
+
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,161 @@
+import argparse
+import json
+import math
+import pathlib
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from dr14meter.audio_file_reader import AudioFileReader
+from dr14meter.audio_math import sha1_track_v1
+from dr14meter.audio_track import AudioTrack
+from dr14meter.compute_dr14 import compute_dr14
+from dr14meter.compute_drv import compute_DRV
+from dr14meter.plot.dr_histogram import compute_hist
+from dr14meter.plot.dynamic_vivacity import dynamic_vivacity
+
+# usage: python bench-suite.py [--quick] [--out results.json] [--baseline baseline.json] [--threshold 0.25]
+#
+# times the numeric and I/O hot paths on synthetic signals, writes the results as json
+# and, given a baseline written by a previous run, fails if a case is slower than
+# baseline * (1 + threshold); differences below NOISE_FLOOR seconds are ignored
+
+NOISE_FLOOR = 0.002
+
+
+def make_signal(seconds, ch, Fs):
+    # a sum of tones as in generate_sample_data.py, with a slow envelope and some noise
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * Fs), dtype=np.float64) / Fs
+    y = np.zeros((t.size, ch), dtype=np.float64)
+    for j, digit in enumerate([3, 1, 4, 1, 5, 9, 2, 6]):
+        y[:, j % ch] += (0.1 + digit / 10) * np.sin((100 + digit * 10) * 2 * np.pi * t)
+    y *= (0.2 + 0.8 * np.abs(np.sin(t / 7)))[:, None]
+    y += 0.01 * rng.standard_normal(y.shape)
+    y = y / np.max(np.abs(y)) * (2 ** 15 - 1)
+    return y.astype(np.int16)
+
+
+def write_wav(file_name, X, Fs):
+    with wave.open(str(file_name), 'wb') as w:
+        w.setnchannels(X.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(Fs)
+        w.writeframes(X.astype('<i2').tobytes())
+
+
+def timeit(f, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def get_cases(quick):
+    lengths = [30] if quick else [30, 300]
+    channels = [1, 2]
+    rates = [44100] if quick else [44100, 48000, 96000]
+    return [(s, ch, Fs) for s in lengths for ch in channels for Fs in rates]
+
+
+def run_suite(quick, repeat, tmp_dir):
+    results = {}
+
+    has_ffmpeg = shutil.which('ffmpeg') is not None
+    try:
+        from dr14meter.compressor import DynCompressor, interp1d
+        compressor = DynCompressor()
+    except ImportError:
+        compressor = None
+
+    for seconds, ch, Fs in get_cases(quick):
+        X = make_signal(seconds, ch, Fs)
+        Y = X / np.float32(2 ** 15 + 1)
+        file_name = pathlib.Path(tmp_dir) / f"{seconds}s_{ch}ch_{Fs}.wav"
+        write_wav(file_name, X, Fs)
+
+        benchmarks = {
+            'compute_dr14': lambda: compute_dr14(Y, Fs),
+            'compute_DRV': lambda: compute_DRV(Y, Fs),
+            'sha1_track_v1': lambda: sha1_track_v1(Y),
+            'read_wav': lambda: AudioFileReader().read_wav(file_name, AudioTrack()),
+            'compute_hist': lambda: compute_hist(Y, Fs, plot=False),
+            'dynamic_vivacity': lambda: dynamic_vivacity(Y, Fs, Plot=False),
+        }
+
+        if has_ffmpeg:
+            benchmarks['ffmpeg_decode'] = lambda: AudioFileReader().read_audio_pipe(file_name, AudioTrack())
+
+        if compressor is not None:
+            benchmarks['dyn_compressor'] = lambda: compressor.dyn_compressor(Y, Fs)
+
+        for name, f in benchmarks.items():
+            key = f"{name}/{seconds}s/{ch}ch/{Fs}"
+            results[key] = timeit(f, repeat)
+            print(f"{key:40s} {results[key]:9.4f} s", flush=True)
+
+        file_name.unlink()
+
+    return results
+
+
+def check_regressions(results, baseline, threshold):
+    regressions = []
+
+    print(f"\n{'case':40s} {'baseline':>9s} {'now':>9s} {'ratio':>7s}")
+    for key, t in results.items():
+        if key not in baseline:
+            continue
+        ratio = t / baseline[key]
+        flag = " REGRESSION" if ratio > 1.0 + threshold and t - baseline[key] > NOISE_FLOOR else ""
+        print(f"{key:40s} {baseline[key]:9.4f} {t:9.4f} {ratio:7.2f}{flag}")
+        if flag:
+            regressions.append(key)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dr14meter micro-benchmarks")
+    parser.add_argument("--quick", action="store_true", help="only 30s tracks at 44100 Hz")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case, the best time is kept")
+    parser.add_argument("--out", help="write the results to this json file")
+    parser.add_argument("--baseline", help="compare with the results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    np.seterr(all='ignore')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_suite(args.quick, args.repeat, tmp_dir)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    if args.out:
+        pathlib.Path(args.out).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())['results']
+        regressions = check_regressions(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import pathlib
+import sys
+import tempfile
+import time
+
+from dr14meter.audio_track import AudioTrack
+from dr14meter.dir_walker import walk_albums
+
+# usage: python bench-walk.py [files [files per album]]
+# builds a tree of empty audio files (200000 by default, artist/album/track) and times
+# the walk of a recursive --skip scan: the previous one (rglob of the directories, then a
+# glob of the files and one of the dr14*.txt of each directory) and walk_albums, with the
+# time until the first album can be scanned. Both must find the same files.
+
+
+def make_tree(root, files, per_album, albums_per_artist=10):
+    for a in range(0, files // per_album):
+        album = root / f"artist {a // albums_per_artist}" / f"album {a}"
+        album.mkdir(parents=True)
+        for t in range(per_album):
+            (album / f"{t:02d} track.flac").touch()
+        (album / "cover.jpg").touch()
+        if a % 2 == 0:
+            (album / "dr14.txt").touch()
+
+
+def old_walk(root):
+    subdirlist = [root] + [p for p in root.rglob('*') if p.is_dir()]
+    for cur_dir in subdirlist:
+        reports = list(cur_dir.glob('dr14*.txt'))
+        files = [x for x in sorted(cur_dir.glob('*')) if x.suffix in AudioTrack.FORMATS]
+        yield cur_dir, files, reports
+
+
+def new_walk(root):
+    for album in walk_albums(root, recursive=True):
+        yield album.path, album.files, album.reports
+
+
+def time_walk(walk, root):
+    t = time.perf_counter()
+    first = None
+    found = {}
+    for cur_dir, files, reports in walk(root):
+        if first is None:
+            first = time.perf_counter() - t
+        found[cur_dir] = (files, len(reports))
+    return time.perf_counter() - t, first, found
+
+
+if __name__ == '__main__':
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    per_album = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    root = pathlib.Path(tmp_dir.name)
+
+    t = time.perf_counter()
+    make_tree(root, files, per_album)
+    print(f"{files} files created in {time.perf_counter() - t:.1f} s")
+
+    results = {}
+    for name, walk in [('glob', old_walk), ('scandir', new_walk)]:
+        wall, first, found = time_walk(walk, root)
+        results[name] = found
+        print(f"{name:8s} {wall:8.2f} s  first album after {first * 1000:8.1f} ms  {len(found)} directories")
+
+    if results['glob'] != results['scandir']:
+        print("the walks do not find the same files")
+        sys.exit(1)